@@ -3,10 +3,15 @@ Simple Flask application for Allowability project.
 Provides health check endpoint and basic info.
 """
 
+import json
 import logging
 import os
+import threading
+import time
 from datetime import datetime
-from flask import Flask, jsonify
+from flask import Flask, g, jsonify, request
+
+from metrics import METHODS, registry as metrics
 
 # Configure logging
 logging.basicConfig(
@@ -21,40 +26,116 @@ app = Flask(__name__)
 # Application metadata
 APP_NAME = "allowability"
 APP_VERSION = "1.0.0"
-START_TIME = datetime.utcnow()
+START_TIME = time.monotonic()
+
+# Seconds between access log lines for each route; requests in between are
+# counted and reported on the next line. 0 logs every request.
+ACCESS_LOG_INTERVAL = float(os.environ.get("ACCESS_LOG_INTERVAL", "10"))
+
+
+def json_template(body, field):
+    """Serialize body as jsonify would, split into (prefix, suffix) bytes around `field`'s value."""
+    marker = f"__{field}__"
+    text = json.dumps(dict(body, **{field: marker}), separators=(",", ":"), sort_keys=True)
+    prefix, suffix = text.split(json.dumps(marker))
+    return prefix.encode(), (suffix + "\n").encode()
+
+
+INDEX_PREFIX, INDEX_SUFFIX = json_template({
+    "name": APP_NAME,
+    "version": APP_VERSION,
+    "status": "running",
+    "environment": os.environ.get("ENVIRONMENT", "unknown"),
+    "endpoints": {
+        "health": "/health",
+        "info": "/",
+        "metrics": "/metrics"
+    }
+}, "uptime_seconds")
+
+HEALTH_PREFIX, HEALTH_SUFFIX = json_template({
+    "status": "ok",
+    "message": "Hello world!"
+}, "timestamp")
+
+
+class AccessLog:
+    """Access log that writes at most one line per route and status per interval.
+
+    Requests in between are only counted, so heavy ALB probing doesn't
+    spend worker time writing log lines.
+    """
+
+    def __init__(self, logger, interval):
+        self.logger = logger
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, method, path, status):
+        # Bucket odd methods like the metrics do, so scanners can't grow the table.
+        if method not in METHODS:
+            method = "other"
+        key = (method, path, status)
+        now = time.monotonic()
+        with self.lock:
+            next_time, skipped = self.routes.get(key, (0.0, 0))
+            if now < next_time:
+                self.routes[key] = (next_time, skipped + 1)
+                return
+            self.routes[key] = (now + self.interval, 0)
+        if skipped:
+            self.logger.info("%s %s %d (+%d more in the last %.0fs)", method, path, status,
+                             skipped, self.interval)
+        else:
+            self.logger.info("%s %s %d", method, path, status)
+
+
+access_log = AccessLog(logging.getLogger("access"), ACCESS_LOG_INTERVAL)
+
+
+@app.before_request
+def start_request():
+    metrics.start_request()
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def log_request(response):
+    # Unknown paths are logged under one name so scanners can't grow the table.
+    path = request.url_rule.rule if request.url_rule else "<unmatched>"
+    metrics.record(path, request.method, response.status_code, time.perf_counter() - g.start_time)
+    g.recorded = True
+    access_log.record(request.method, path, response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request(error=None):
+    # Recording a request also takes it off the in-flight count.
+    if not g.get("recorded"):
+        metrics.end_request()
 
 
 @app.route('/')
 def index():
     """Root endpoint with basic application info."""
-    uptime = (datetime.utcnow() - START_TIME).total_seconds()
-    
-    response = {
-        "name": APP_NAME,
-        "version": APP_VERSION,
-        "status": "running",
-        "uptime_seconds": uptime,
-        "environment": os.environ.get("ENVIRONMENT", "unknown"),
-        "endpoints": {
-            "health": "/health",
-            "info": "/"
-        }
-    }
-    
-    logger.info(f"Index endpoint accessed - uptime: {uptime:.2f}s")
-    return jsonify(response), 200
+    uptime = time.monotonic() - START_TIME
+    body = INDEX_PREFIX + repr(uptime).encode() + INDEX_SUFFIX
+    return app.response_class(body, mimetype="application/json")
 
 
 @app.route('/health')
 def health():
     """Health check endpoint for ALB target group."""
-    response = {
-        "status": "ok",
-        "message": "Hello world!",
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    
-    return jsonify(response), 200
+    body = HEALTH_PREFIX + b'"' + datetime.utcnow().isoformat().encode() + b'"' + HEALTH_SUFFIX
+    return app.response_class(body, mimetype="application/json")
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request and process metrics of all workers, in Prometheus text format."""
+    return app.response_class(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.errorhandler(404)
@@ -0,0 +1,43 @@
+"""
+Gunicorn settings for the Allowability app, overridable through the environment.
+
+The default is the threaded sync setup the image has always used (2 workers x
+4 threads). Set GUNICORN_WORKER_CLASS=gevent for the async worker, which
+serves up to GUNICORN_WORKER_CONNECTIONS concurrent requests per worker.
+"""
+
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+
+# Longer than the ALB's 60s idle timeout, so the ALB always closes idle
+# connections first and never sends a request down one gunicorn just closed.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "65"))
+
+# Requests are logged by the app's rate-limited access log instead.
+accesslog = None
+errorlog = "-"
+
+# Workers share request metrics through snapshot files here, so /metrics
+# reports every worker whichever one serves it. See metrics.py.
+metrics_dir = os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "allowability-metrics"))
+
+
+def on_starting(server):
+    # Start from zero rather than adding up a previous run's workers.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def worker_exit(server, worker):
+    # Keep the requests this worker handled since its last periodic flush.
+    from metrics import registry
+    registry.flush()
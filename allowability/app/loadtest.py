@@ -0,0 +1,107 @@
+"""
+Load test for the Allowability app.
+
+Sends requests to one URL from a number of keep-alive connections for a fixed
+time, then reports requests/sec and latency percentiles. Start a local server
+first, e.g.:
+
+    gunicorn --config gunicorn.conf.py app:app
+    python loadtest.py http://127.0.0.1:8080/health --connections 32 --duration 10
+
+Connections are spread over --processes client processes, so the client isn't
+held back by the GIL before the server is.
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def run_connection(url, deadline, latencies, errors):
+    """Send requests over one keep-alive connection until the deadline."""
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    conn = None
+    while time.perf_counter() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if response.status >= 400:
+            errors.append(1)
+        if response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def run_process(args):
+    """Run `connections` connections on threads; returns (latencies, error count)."""
+    url, connections, duration = args
+    deadline = time.perf_counter() + duration
+    latencies, errors = [], []
+    workers = [threading.Thread(target=run_connection, args=(url, deadline, latencies, errors))
+               for _ in range(connections)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, len(errors)
+
+
+def percentile(values, p):
+    """The p-th percentile of sorted values."""
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test an HTTP endpoint and report throughput and latency.")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8080/health",
+                        help="URL to request (default: %(default)s)")
+    parser.add_argument("-c", "--connections", type=int, default=16,
+                        help="Concurrent keep-alive connections (default: %(default)s)")
+    parser.add_argument("-d", "--duration", type=float, default=10,
+                        help="Seconds to run for (default: %(default)s)")
+    parser.add_argument("-p", "--processes", type=int, default=min(4, multiprocessing.cpu_count()),
+                        help="Client processes to spread connections over (default: %(default)s)")
+    args = parser.parse_args()
+
+    processes = max(1, min(args.processes, args.connections))
+    shares = [args.connections // processes + (i < args.connections % processes) for i in range(processes)]
+    with multiprocessing.Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.map(run_process, [(args.url, share, args.duration) for share in shares])
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for process_latencies, _ in results for latency in process_latencies)
+    errors = sum(error_count for _, error_count in results)
+    if not latencies:
+        print(f"No successful requests ({errors} errors).")
+        return
+
+    print(f"{args.url}: {args.connections} connections, {elapsed:.1f}s")
+    print(f"  requests:  {len(latencies)} ({errors} errors)")
+    print(f"  req/sec:   {len(latencies) / elapsed:.0f}")
+    print(f"  latency:   p50 {percentile(latencies, 50) * 1000:.2f}ms, "
+          f"p90 {percentile(latencies, 90) * 1000:.2f}ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f}ms, "
+          f"max {latencies[-1] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
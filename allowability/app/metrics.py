@@ -0,0 +1,212 @@
+"""
+Request metrics for the Allowability app, exposed in Prometheus text format.
+
+Each process keeps its counts in memory, so recording a request is a bisect,
+a lock and a few list updates. When METRICS_DIR is set (gunicorn.conf.py sets
+it), every worker also writes a snapshot of its counts to a file there about
+once a second, and a scrape, whichever worker serves it, adds up all of them.
+Request counts and latencies of workers that have exited are kept, so
+counters never go backwards; in-flight requests and memory are only counted
+for workers that are still running.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between snapshots written to METRICS_DIR.
+FLUSH_INTERVAL = 1.0
+
+# Anything else is counted as "other", so odd methods can't add label values.
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def resident_memory():
+    """Current resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def cpu_seconds():
+    """User plus system CPU time used by this process."""
+    times = os.times()
+    return times.user + times.system
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-process request counts, latency histograms and in-flight requests."""
+
+    def __init__(self, directory=None, buckets=BUCKETS):
+        self.directory = directory
+        self.buckets = buckets
+        self._reset()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if hasattr(os, "register_at_fork"):
+            # A worker forked from a process that already recorded (gunicorn
+            # --preload) starts from zero and runs its own flusher.
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        # (route, method, status) -> bucket counts followed by the latency sum.
+        self.series = {}
+        self.in_flight = 0
+        self.flusher = None
+
+    def start_request(self):
+        with self.lock:
+            self.in_flight += 1
+        if self.flusher is None and self.directory:
+            self._start_flusher()
+
+    def end_request(self):
+        """Count a request as no longer in flight without recording it."""
+        with self.lock:
+            self.in_flight -= 1
+
+    def record(self, route, method, status, seconds):
+        """Count a finished request and its latency, and take it off the in-flight count."""
+        index = bisect_left(self.buckets, seconds)
+        key = (route, method if method in METHODS else "other", status)
+        with self.lock:
+            self.in_flight -= 1
+            counts = self.series.get(key)
+            if counts is None:
+                counts = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += seconds
+
+    def snapshot(self):
+        """This process's metrics as a JSON-serializable dict."""
+        with self.lock:
+            series = [[route, method, status, list(counts)]
+                      for (route, method, status), counts in self.series.items()]
+            in_flight = self.in_flight
+        return {
+            "pid": os.getpid(),
+            "series": series,
+            "in_flight": in_flight,
+            "rss": resident_memory(),
+            "cpu": cpu_seconds(),
+        }
+
+    def flush(self):
+        """Write this process's snapshot to the metrics directory."""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp, path)
+
+    def _start_flusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True)
+        self.flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            try:
+                self.flush()
+            except OSError:
+                pass
+            time.sleep(FLUSH_INTERVAL)
+
+    def collect(self):
+        """Snapshots of every process sharing the metrics directory, this one's live."""
+        own = self.snapshot()
+        snapshots = [own]
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name == f"{own['pid']}.json":
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def render(self):
+        """All processes' metrics, added up, in Prometheus text exposition format."""
+        series = {}
+        in_flight = 0
+        rss = 0
+        cpu = 0.0
+        workers = 0
+        for snapshot in self.collect():
+            for route, method, status, counts in snapshot["series"]:
+                total = series.setdefault((route, method, status), [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+            cpu += snapshot["cpu"]
+            if snapshot["pid"] == os.getpid() or pid_alive(snapshot["pid"]):
+                workers += 1
+                in_flight += snapshot["in_flight"]
+                rss += snapshot["rss"] or 0
+
+        requests = []
+        histograms = []
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for (route, method, status), counts in sorted(series.items()):
+            labels = f'route="{escape(route)}",method="{method}",status="{status}"'
+            cumulative = 0
+            for le, count in zip(bounds, counts):
+                cumulative += count
+                histograms.append(f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            histograms.append(f"http_request_duration_seconds_sum{{{labels}}} {counts[-1]!r}")
+            histograms.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+            requests.append(f"http_requests_total{{{labels}}} {cumulative}")
+
+        lines = [
+            "# HELP http_requests_total Requests handled, by route, method and status.",
+            "# TYPE http_requests_total counter",
+            *requests,
+            "# HELP http_request_duration_seconds Time spent handling requests.",
+            "# TYPE http_request_duration_seconds histogram",
+            *histograms,
+            "# HELP http_requests_in_flight Requests being handled right now.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {in_flight}",
+            "# HELP process_resident_memory_bytes Resident memory of all running workers.",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {rss}",
+            "# HELP process_cpu_seconds_total User and system CPU time of all workers, including exited ones.",
+            "# TYPE process_cpu_seconds_total counter",
+            f"process_cpu_seconds_total {cpu!r}",
+            "# HELP app_workers Worker processes reporting metrics.",
+            "# TYPE app_workers gauge",
+            f"app_workers {workers}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+registry = Metrics(os.environ.get("METRICS_DIR") or None)
@@ -26,25 +26,55 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 import argparse
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import sqlite3
 import urllib.parse
 import posixpath
 import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 class AbstractItem(object):
+	"""A single file produced by an adaptor.
+
+	Items start out unloaded: creating one costs nothing beyond its url, and
+	its bytes are fetched only when needed and dropped again by unload()."""
+
+	def __init__(self, url):
+		self.url = url
+
 	def load(self):
-		pass
+		"""Fetch the item's bytes into memory.
+		
+		Subclasses MUST override this method."""
+		raise NotImplementedError("Subclasses must override load")
 	
 	def is_loaded(self):
-		pass
+		"""Returns whether the bytes are in memory.
+		
+		Subclasses SHOULD override this method"""
+		return False
 	
 	def unload(self):
+		"""Drop the bytes fetched by load()."""
 		pass
 	
 	def save(self, fileOrPath):
-		pass
+		"""Write the item to an open binary file or a path, then unload it. 
+		Returns the number of bytes fetched.
+		
+		Subclasses MUST override this method."""
+		raise NotImplementedError("Subclasses must override save")
 		
 
 class AbstractAdaptor(object):
@@ -54,15 +84,17 @@ class AbstractAdaptor(object):
 	There is a moral argument to be made that they should all raise 
 	NotImplemented."""
 
-	def __init__(self, url, lazy=False):
-		"""Initializer. Takes the URL for this API. Optionally specify 
-		lazy=True to load the data from the source at initialization."""
+	def __init__(self, url, lazy=True):
+		"""Initializer. Takes the URL for this API. Nothing is fetched until
+		load() or items() is called unless lazy=False is given, in which case
+		the data are loaded from the source at initialization."""
 		self.url = url
-		if lazy:
+		if not lazy:
 			self.load()
 
-	def valdiate_url(self, url):
-		"""Validates whether the given URL can be handled by this Adaptor"""
+	@classmethod
+	def validate_url(cls, url_parts):
+		"""Validates whether the given (parsed) URL can be handled by this Adaptor"""
 		return True	 #or not implemented?
 	
 	def load(self):
@@ -77,15 +109,320 @@ class AbstractAdaptor(object):
 		Subclasses SHOULD override this method"""
 		return False
 	
+	def subdir(self):
+		"""Directory name to save items into when not flattening."""
+		return ""
+	
 	def items(self):
-		pass
+		"""Yields an AbstractItem for each file, loading first if needed.
+		
+		Subclasses MUST override this method."""
+		raise NotImplementedError("Subclasses must override items")
+
+class ImgurItem(AbstractItem):
+	"""An image (or gif/video) hosted on imgur."""
+
+	def __init__(self, url, session=requests):
+		super(ImgurItem, self).__init__(url)
+		self.session = session
+		self.data = None
+
+	def load(self):
+		response = self.session.get(self.url, headers=auth_header)
+		response.raise_for_status()
+		self.data = response.content
+
+	def is_loaded(self):
+		return self.data is not None
+
+	def unload(self):
+		self.data = None
+
+	def save(self, fileOrPath):
+		"""Saves the image. Unless load() was called first, the bytes are
+		streamed straight to disk and never held in memory; paths get the
+		atomic, resumable treatment of download()."""
+		try:
+			if not hasattr(fileOrPath, "write"):
+				if not self.is_loaded():
+					return download(self.url, fileOrPath, self.session)
+				partial = partial_path(fileOrPath)
+				with open(partial, "wb") as f:
+					f.write(self.data)
+				os.replace(partial, fileOrPath)
+				return len(self.data)
+			if self.is_loaded():
+				fileOrPath.write(self.data)
+				return len(self.data)
+			written = 0
+			with self.session.get(self.url, headers=auth_header, stream=True) as response:
+				response.raise_for_status()
+				for chunk in response.iter_content(CHUNK_SIZE):
+					fileOrPath.write(chunk)
+					written += len(chunk)
+			return written
+		finally:
+			self.unload()
 
 class ImgurAdaptor(AbstractAdaptor):
-	pass
+	"""Resolves an imgur album, image page or direct link to its images.
+
+	load() makes at most one API call (none if the response is cached) and
+	keeps only the image links; items() hands out unloaded ImgurItems."""
+
+	def __init__(self, url, session=requests, cache=None, bucket=None, lazy=True):
+		self.url_parts = urllib.parse.urlparse(url)
+		self.session = session
+		self.cache = cache
+		self.bucket = bucket
+		self.links = None
+		super(ImgurAdaptor, self).__init__(url, lazy)
+
+	@classmethod
+	def validate_url(cls, url_parts):
+		return is_imgur_url(url_parts)
+
+	def load(self):
+		self.links = list(images(self.url_parts, self.session, self.cache, self.bucket))
+
+	def is_loaded(self):
+		return self.links is not None
+
+	def subdir(self):
+		return subdir_for_url(self.url_parts)
+
+	def items(self):
+		if not self.is_loaded():
+			self.load()
+		for link in self.links:
+			yield ImgurItem(link, self.session)
+
+# Adaptors tried, in order, by adaptor_for_url.
+ADAPTORS = (ImgurAdaptor,)
+
+def adaptor_for_url(url_parts, **kwargs):
+	"""Returns an unloaded adaptor for url_parts, or None if none handles it."""
+	for adaptor_class in ADAPTORS:
+		if adaptor_class.validate_url(url_parts):
+			return adaptor_class(urllib.parse.urlunparse(url_parts), **kwargs)
+	return None
 
 client_id = "7259c2beefdb373"
 auth_header = {"Authorization" : "Client-ID %s" % client_id}
 
+# imgur answers 429 once the client id's credits run out, and its API and CDN
+# hand out the odd 5xx under load; make_session has urllib3 retry both.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def make_session(pool_size=10, retries=3):
+	"""Returns a requests.Session shared by the API and download calls.
+
+	Connections are kept alive and pooled per host (up to pool_size each), and
+	GET/HEAD requests that hit one of RETRY_STATUSES are retried with
+	exponential backoff, honoring Retry-After when the server sends it."""
+	retry = Retry(total=retries, backoff_factor=0.5,
+		status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(["GET", "HEAD"]),
+		respect_retry_after_header=True, raise_on_status=False)
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+		max_retries=retry)
+	session = requests.Session()
+	session.headers.update(auth_header)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	return session
+
+def default_cache_path():
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "slurpur", "cache.sqlite")
+
+class Cache(object):
+	"""On-disk cache of API responses plus a content-hash index of downloads.
+
+	API responses expire after ttl seconds. The index maps each image url to
+	the SHA-256 of its contents and each digest to the files holding it, so an
+	image seen before (in any album, on any run) can be hardlinked instead of
+	downloaded. It lives in SQLite so several slurpur processes can fill it at
+	once, and the pool's resolver and download threads each open their own
+	connection to it."""
+
+	def __init__(self, path, ttl=3600):
+		self.path = path
+		self.ttl = ttl
+		self.local = threading.local()
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with self.connection() as conn:
+			conn.execute("""CREATE TABLE IF NOT EXISTS api
+				(url TEXT PRIMARY KEY, fetched REAL, body TEXT)""")
+			conn.execute("""CREATE TABLE IF NOT EXISTS digests
+				(url TEXT PRIMARY KEY, digest TEXT)""")
+			conn.execute("""CREATE TABLE IF NOT EXISTS files
+				(path TEXT PRIMARY KEY, digest TEXT)""")
+			conn.execute("CREATE INDEX IF NOT EXISTS files_digest ON files (digest)")
+
+	def connection(self):
+		conn = getattr(self.local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=30)
+			conn.execute("PRAGMA journal_mode=WAL")
+			self.local.conn = conn
+		return conn
+
+	def get_api(self, url):
+		"""Returns the cached JSON for url, or None if absent or stale."""
+		row = self.connection().execute("SELECT fetched, body FROM api WHERE url = ?",
+			(url,)).fetchone()
+		if row is None or time.time() - row[0] > self.ttl:
+			return None
+		return json.loads(row[1])
+
+	def put_api(self, url, obj):
+		with self.connection() as conn:
+			conn.execute("INSERT OR REPLACE INTO api VALUES (?, ?, ?)",
+				(url, time.time(), json.dumps(obj)))
+
+	def digest_for_url(self, url):
+		row = self.connection().execute("SELECT digest FROM digests WHERE url = ?",
+			(url,)).fetchone()
+		return row[0] if row else None
+
+	def paths_for_digest(self, digest):
+		rows = self.connection().execute("SELECT path FROM files WHERE digest = ?",
+			(digest,)).fetchall()
+		return [row[0] for row in rows]
+
+	def record(self, url, path, digest):
+		with self.connection() as conn:
+			conn.execute("INSERT OR REPLACE INTO digests VALUES (?, ?)", (url, digest))
+			conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+				(os.path.abspath(path), digest))
+
+	def forget(self, path):
+		with self.connection() as conn:
+			conn.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+
+def hash_file(path):
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def link_into_place(source, destination):
+	"""Atomically makes destination a hardlink to source. Returns success."""
+	temp = partial_path(destination) + ".link"
+	try:
+		if os.path.exists(temp):
+			os.remove(temp)
+		os.link(source, temp)
+		os.replace(temp, destination)
+	except OSError as e:
+		return False
+	remove_partial(destination)
+	return True
+
+def find_duplicate(cache, digest, path):
+	"""Returns an existing file other than path holding digest, or None."""
+	for candidate in cache.paths_for_digest(digest):
+		if candidate == os.path.abspath(path):
+			continue
+		if os.path.isfile(candidate):
+			return candidate
+		cache.forget(candidate)
+	return None
+
+class HostLimiter(object):
+	"""Caps the number of simultaneous downloads from any one host."""
+
+	def __init__(self, per_host):
+		self.per_host = per_host
+		self.lock = threading.Lock()
+		self.semaphores = {}
+
+	def slot(self, url):
+		"""Returns a semaphore to hold (with `with`) while talking to url's host."""
+		host = urllib.parse.urlparse(url).netloc.lower()
+		with self.lock:
+			semaphore = self.semaphores.get(host)
+			if semaphore is None:
+				semaphore = threading.BoundedSemaphore(self.per_host)
+				self.semaphores[host] = semaphore
+		return semaphore
+
+class TokenBucket(object):
+	"""Paces API calls across threads.
+
+	Starts out allowing `rate` calls per second in bursts of up to `capacity`.
+	After each response, update() spreads the calls imgur says remain over the
+	time left until the limit resets, and stops all calls until then if none
+	remain."""
+
+	def __init__(self, rate=10.0, capacity=10):
+		self.max_rate = rate
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = float(capacity)
+		self.updated = time.monotonic()
+		self.paused_until = 0.0
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""Blocks until a call may be made."""
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if now >= self.paused_until and self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+			time.sleep(wait)
+
+	def update(self, headers):
+		"""Retunes the rate from an imgur API response's X-RateLimit headers."""
+		remaining = [int(headers[name]) for name in
+			("X-RateLimit-UserRemaining", "X-RateLimit-ClientRemaining") if name in headers]
+		if not remaining:
+			return
+		remaining = min(remaining)
+		reset = headers.get("X-RateLimit-UserReset")
+		seconds = 3600.0
+		if reset:
+			seconds = max(float(reset) - time.time(), 1.0)
+		with self.lock:
+			if remaining <= 0:
+				self.paused_until = time.monotonic() + seconds
+			else:
+				self.rate = min(self.max_rate, remaining / seconds)
+
+class Stats(object):
+	"""Thread-safe counters for the end-of-run summary."""
+
+	FIELDS = ("resolved", "unresolved", "downloaded", "linked", "skipped", "failed")
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counts = dict.fromkeys(self.FIELDS, 0)
+		self.bytes = 0
+		self.start = time.monotonic()
+
+	def add(self, field, nbytes=0):
+		with self.lock:
+			self.counts[field] += 1
+			self.bytes += nbytes
+
+	def summary(self):
+		elapsed = max(time.monotonic() - self.start, 1e-6)
+		megabytes = self.bytes / (1024.0 * 1024.0)
+		lines = [
+			"Resolved {resolved} urls ({unresolved} failed)".format(**self.counts),
+			"Downloaded {downloaded}, linked {linked}, skipped {skipped}, failed {failed}".format(**self.counts),
+			"{:.2f} MiB in {:.2f}s ({:.2f} MiB/s)".format(megabytes, elapsed, megabytes / elapsed),
+		]
+		return "\n".join(lines)
+
 def improper_usage(msg, parser):
 	if msg:
 		sys.stderr.write(msg)
@@ -128,7 +465,25 @@ def album_api_url(id):
 def image_api_url(id):
 	return "https://api.imgur.com/3/image/%s" % id
 
-def images(url_parts):
+def api_json(api_url, session=requests, cache=None, bucket=None):
+	"""GETs api_url as JSON, going through cache when one is given and waiting
+	on bucket, if any, before touching the network."""
+	if cache:
+		cached = cache.get_api(api_url)
+		if cached is not None:
+			return cached
+	if bucket:
+		bucket.acquire()
+	api_response = session.get(api_url, headers=auth_header)
+	if bucket:
+		bucket.update(api_response.headers)
+	api_response.raise_for_status()
+	response_json = api_response.json()
+	if cache:
+		cache.put_api(api_url, response_json)
+	return response_json
+
+def images(url_parts, session=requests, cache=None, bucket=None):
 	api_url = ""
 	is_album = is_album_url(url_parts)
 	is_image = is_image_url(url_parts)
@@ -143,9 +498,7 @@ def images(url_parts):
 		yield urllib.parse.urlunparse(url_parts)
 		return
 
-	api_response = requests.get(api_url, headers=auth_header)
-	api_response.raise_for_status()
-	response_json = api_response.json()
+	response_json = api_json(api_url, session, cache, bucket)
 	
 	if is_album:
 		image_list = response_json["data"]
@@ -155,11 +508,86 @@ def images(url_parts):
 		image = response_json["data"]
 		yield image["link"]
 
-def download(url, destination):
-	response = requests.get(url, headers=auth_header)
-	response.raise_for_status()
-	with open(destination, "wb") as f:
-		f.write(response.content)
+# Bytes read from the socket per write when streaming a download.
+CHUNK_SIZE = 64 * 1024
+
+class IncompleteDownload(RequestException):
+	"""The connection closed before Content-Length bytes arrived."""
+
+def partial_path(destination):
+	return destination + ".part"
+
+def validator_path(destination):
+	"""Where the ETag (or Last-Modified) of a partial download is kept."""
+	return partial_path(destination) + ".validator"
+
+def read_validator(destination):
+	try:
+		with open(validator_path(destination), "r") as f:
+			return f.read().strip() or None
+	except IOError:
+		return None
+
+def remove_partial(destination):
+	for path in (partial_path(destination), validator_path(destination)):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+def response_validator(response):
+	"""Returns a value usable in If-Range, or None. Weak ETags are not allowed
+	there, so fall back to Last-Modified for those."""
+	etag = response.headers.get("ETag")
+	if etag and not etag.startswith("W/"):
+		return etag
+	return response.headers.get("Last-Modified")
+
+def download(url, destination, session=requests):
+	"""Streams url to destination. Returns the number of bytes fetched.
+
+	Data are written to destination.part and renamed into place only once the
+	whole body has arrived, so an interrupted transfer never looks finished. A
+	leftover .part file is resumed with a Range request; If-Range carries the
+	validator seen when it was started, so a changed file is fetched afresh."""
+	partial = partial_path(destination)
+	headers = dict(auth_header)
+	offset = 0
+	validator = read_validator(destination)
+	if validator and os.path.exists(partial):
+		offset = os.path.getsize(partial)
+		headers["Range"] = "bytes={}-".format(offset)
+		headers["If-Range"] = validator
+
+	written = 0
+	with session.get(url, headers=headers, stream=True) as response:
+		if response.status_code == 416:
+			# The partial file is no good for this resource; start over.
+			remove_partial(destination)
+			return download(url, destination, session)
+		response.raise_for_status()
+		if response.status_code != 206:
+			offset = 0
+			remove_partial(destination)
+			validator = response_validator(response)
+			if validator:
+				with open(validator_path(destination), "w") as f:
+					f.write(validator)
+		expected = None
+		length = response.headers.get("Content-Length")
+		if length and not response.headers.get("Content-Encoding"):
+			expected = offset + int(length)
+		with open(partial, "ab" if offset else "wb") as f:
+			for chunk in response.iter_content(CHUNK_SIZE):
+				f.write(chunk)
+				written += len(chunk)
+
+	if expected is not None and offset + written != expected:
+		raise IncompleteDownload("got {} of {} bytes from {}".format(
+			offset + written, expected, url))
+	os.replace(partial, destination)
+	remove_partial(destination)
+	return written
 
 def get_url_base(url_parts):
 	base = url_parts.netloc
@@ -176,22 +604,25 @@ def is_gfycat_url(url_parts):
 	return "gfycat.com" in get_url_base(url_parts)
 
 def is_valid_url(url_parts):
-	return is_imgur_url(url_parts)# or is_gfycat_url(url_parts)
+	return any(adaptor.validate_url(url_parts) for adaptor in ADAPTORS)
 
 def urls_for_args(in_arg, is_filename):
-	urls = None
+	"""Yields parsed urls from the arguments. Files are read lazily, a line at
+	a time, so arbitrarily long lists never sit in memory."""
 	if is_filename or not in_arg:
 		in_file = sys.stdin
 		if in_arg:
 			try:
 				in_file = open(in_arg, "r")
 			except IOError as e:
-				sys.stderr.write("Unable to open file {}".format(in_arg))
-		urls = [line.strip() for line in in_file]
+				sys.stderr.write("Unable to open file {}\n".format(in_arg))
+				return
+		for line in in_file:
+			line = line.strip()
+			if line:
+				yield urllib.parse.urlparse(line)
 	else:
-		urls = [in_arg]
-	urls = list(map(urllib.parse.urlparse, urls))
-	return urls
+		yield urllib.parse.urlparse(in_arg)
 
 def make_filename(url, prefix, counter):
 	imgur_filename = posixpath.basename(url)
@@ -202,31 +633,161 @@ def make_filename(url, prefix, counter):
 		base = "{}-{}".format(prefix, counter)
 	return "{}{}".format(base, ext)
 
-def already_downloaded(path):
+def already_downloaded(path, url=None, session=requests):
+	"""Returns whether path holds a complete copy of url.
+
+	download() only renames finished files into place, but files written by
+	older versions (or other tools) may be truncated, so when url is given the
+	size on disk is checked against the Content-Length of a HEAD request."""
 	try:
 		stat = os.stat(path)
-		return stat.st_size != 0
 	except OSError as e:
 		return False
-
-def process(url_parts, output_dir=".", prefix=None, counter=0, overwrite=False):
+	if stat.st_size == 0:
+		return False
+	if url is None:
+		return True
 	try:
-		for url in images(url_parts):
-			filename = make_filename(url, prefix, counter)
-			path = os.path.join(output_dir, filename)
-			if not already_downloaded(path) or overwrite:
-				print("Downloading {} to {}".format(url, path))
-				download(url, path)
-				counter += 1
-			else:
-				print("Skipping {}: {} already exists".format(url, path))
+		response = session.head(url, headers=auth_header, allow_redirects=True)
 	except RequestException as e:
-		url = urllib.parse.urlunparse(url_parts)
-		sys.stderr.write("Error downloading from url {}: {}\n".format(url, e))
-		if output_dir != "." and not os.listdir(output_dir):
-			sys.stderr.write("Cleaning up unused directory {}\n".format(output_dir))
-			os.rmdir(output_dir)
-	return counter
+		# Can't tell; trust what is on disk rather than fail the skip check.
+		return True
+	length = response.headers.get("Content-Length")
+	if not response.ok or not length or response.headers.get("Content-Encoding"):
+		return True
+	return int(length) == stat.st_size
+
+def cleanup(output_dir):
+	if output_dir != "." and os.path.isdir(output_dir) and not os.listdir(output_dir):
+		sys.stderr.write("Cleaning up unused directory {}\n".format(output_dir))
+		os.rmdir(output_dir)
+
+class Pipeline(object):
+	"""Resolves urls and downloads their images on a shared thread pool.
+
+	Urls are pulled lazily and at most `window` resolutions, plus four times
+	as many downloads, are in flight at once, so memory stays flat however long
+	the list is. Resolutions are collected in input order and counters are
+	handed out before downloads are queued, so filenames do not depend on which
+	request finishes first."""
+
+	def __init__(self, pool, window, session, limiter, stats, cache=None, bucket=None,
+			output_directory=".", prefix=None, flatten=False, overwrite=False):
+		self.pool = pool
+		self.window = window
+		self.session = session
+		self.limiter = limiter
+		self.stats = stats
+		self.cache = cache
+		self.bucket = bucket
+		self.output_directory = output_directory
+		self.prefix = prefix
+		self.flatten = flatten
+		self.overwrite = overwrite
+		self.pending = threading.BoundedSemaphore(window * 4)
+		self.counter = 0
+		self.used_dirs = set()
+
+	def resolve(self, url_parts):
+		"""Returns a loaded adaptor for url_parts, or None on error."""
+		adaptor = adaptor_for_url(url_parts, session=self.session, cache=self.cache,
+			bucket=self.bucket)
+		try:
+			adaptor.load()
+		except RequestException as e:
+			url = urllib.parse.urlunparse(url_parts)
+			sys.stderr.write("Error downloading from url {}: {}\n".format(url, e))
+			self.stats.add("unresolved")
+			return None
+		self.stats.add("resolved")
+		return adaptor
+
+	def fetch(self, item, path):
+		"""Worker body: downloads a single image, holding a slot for its host.
+
+		With a cache, an image whose contents are already on disk elsewhere is
+		hardlinked rather than downloaded, and a fresh download that turns out
+		to duplicate an existing file is replaced by a link to it."""
+		url = item.url
+		cache = self.cache
+		if cache and not self.overwrite and not os.path.exists(path):
+			digest = cache.digest_for_url(url)
+			duplicate = digest and find_duplicate(cache, digest, path)
+			if duplicate and link_into_place(duplicate, path):
+				print("Linking {} to {}".format(path, duplicate))
+				cache.record(url, path, digest)
+				self.stats.add("linked")
+				return
+		with self.limiter.slot(url):
+			if not self.overwrite and already_downloaded(path, url, self.session):
+				print("Skipping {}: {} already exists".format(url, path))
+				if cache and not cache.digest_for_url(url):
+					cache.record(url, path, hash_file(path))
+				self.stats.add("skipped")
+				return
+			print("Downloading {} to {}".format(url, path))
+			try:
+				nbytes = item.save(path)
+			except RequestException as e:
+				sys.stderr.write("Error downloading from url {}: {}\n".format(url, e))
+				self.stats.add("failed")
+				return
+		self.stats.add("downloaded", nbytes)
+		if cache:
+			digest = hash_file(path)
+			duplicate = find_duplicate(cache, digest, path)
+			if duplicate and link_into_place(duplicate, path):
+				print("Linked duplicate {} to {}".format(path, duplicate))
+			cache.record(url, path, digest)
+
+	def queue(self, adaptor):
+		"""Queues a download for each of the adaptor's items, blocking while
+		the downloads already in flight are at their limit."""
+		output_dir = self.output_directory
+		if not self.flatten:
+			output_dir = os.path.join(output_dir, adaptor.subdir())
+		if not prepare_destination(output_dir):
+			print("Could not write to {}".format(output_dir))
+			return
+		self.used_dirs.add(output_dir)
+		for item in adaptor.items():
+			filename = make_filename(item.url, self.prefix, self.counter)
+			path = os.path.join(output_dir, filename)
+			self.counter += 1
+			self.pending.acquire()
+			future = self.pool.submit(self.fetch, item, path)
+			future.add_done_callback(functools.partial(self.fetched, item.url))
+
+	def fetched(self, url, future):
+		"""Done callback for a download: frees its slot and reports anything
+		fetch let through, which would otherwise vanish with the future."""
+		self.pending.release()
+		if future.cancelled():
+			return
+		e = future.exception()
+		if e is not None:
+			sys.stderr.write("Error saving {}: {!r}\n".format(url, e))
+			self.stats.add("failed")
+
+	def run(self, urls):
+		"""Processes every url. The caller shuts the pool down to wait for the
+		last downloads, then calls finish()."""
+		window = collections.deque()
+		for url_parts in urls:
+			window.append(self.pool.submit(self.resolve, url_parts))
+			if len(window) >= self.window:
+				self.collect(window.popleft())
+		while window:
+			self.collect(window.popleft())
+
+	def collect(self, future):
+		adaptor = future.result()
+		if adaptor is not None:
+			self.queue(adaptor)
+
+	def finish(self):
+		for output_dir in self.used_dirs:
+			cleanup(output_dir)
 
 def main(args):
 	in_arg = args.arg
@@ -236,30 +797,39 @@ def main(args):
 	should_flatten = args.flatten
 	overwrite = args.overwrite
 
-	urls = urls_for_args(in_arg, is_filename)
-	urls = list(filter(is_valid_url, urls))
-	if not urls:
+	urls = filter(is_valid_url, urls_for_args(in_arg, is_filename))
+	first = next(urls, None)
+	if first is None:
 		print("No valid urls provided")
 		return 0
-	
-	print("Downloading from {} urls".format(len(urls)))
+	urls = itertools.chain([first], urls)
 
 	dest_ok = prepare_destination(output_directory)
 	if not dest_ok:
 		print("Could not write to {}".format(output_directory))
 		return -1
 
-	counter = 0
-	for url_parts in urls:
-		final_output_dir = output_directory
-		if not should_flatten:
-			subdir = subdir_for_url(url_parts)
-			final_output_dir = os.path.join(output_directory, subdir)
-		dest_ok = prepare_destination(final_output_dir)
-		if not dest_ok:
-			print("Could not write to {}".format(final_output_dir))
-			continue
-		counter += process(url_parts, final_output_dir, prefix, counter, overwrite)
+	session = make_session(args.pool_size or args.jobs, args.retries)
+	limiter = HostLimiter(args.per_host)
+	stats = Stats()
+	bucket = TokenBucket(args.api_rate)
+	cache = None
+	if not args.no_cache:
+		cache = Cache(args.cache, args.cache_ttl)
+	pool = ThreadPoolExecutor(max_workers=args.jobs)
+	pipeline = Pipeline(pool, args.jobs * 2, session, limiter, stats, cache, bucket,
+		output_directory, prefix, should_flatten, overwrite)
+	try:
+		pipeline.run(urls)
+	except KeyboardInterrupt:
+		# Drop the queued downloads rather than waiting for them; only the
+		# ones already running finish, leaving .part files to resume from.
+		pool.shutdown(wait=False, cancel_futures=True)
+		raise
+	pool.shutdown()
+	session.close()
+	pipeline.finish()
+	print(stats.summary())
 	return 0
 
 if __name__ == "__main__":
@@ -278,8 +848,34 @@ if __name__ == "__main__":
 	downloaded files in the same directory""")
 	parser.add_argument("--overwrite", action="store_true", help="""By default, slurpur will 
 	skip redownloading files (determined by the existence of a file of the same name at a 
-	given path with non-zero size). Pass to always download.""")
+	given path whose size matches the server's Content-Length). Interrupted downloads 
+	are resumed from their .part file. Pass to always download.""")
+	parser.add_argument("-j", "--jobs", type=int, default=8, help="""Number of
+	urls to resolve and images to download at once. (default: 8)""")
+	parser.add_argument("--per-host", type=int, default=4, help="""Maximum number
+	of simultaneous downloads from a single host. (default: 4)""")
+	parser.add_argument("--pool-size", type=int, help="""Number of keep-alive
+	connections to hold open per host. (default: same as --jobs)""")
+	parser.add_argument("--retries", type=int, default=3, help="""Times to retry
+	a request that was rate limited (429) or hit a server error (5xx).
+	(default: 3)""")
+	parser.add_argument("--api-rate", type=float, default=10, help="""Most imgur
+	API calls to make per second. Slower if the API's rate-limit headers say so.
+	(default: %(default)s)""")
+	parser.add_argument("--cache", default=default_cache_path(), help="""Path of
+	the cache of API responses and downloaded image hashes, shared between runs.
+	(default: %(default)s)""")
+	parser.add_argument("--cache-ttl", type=float, default=3600, help="""Seconds
+	before a cached API response is fetched again. (default: %(default)s)""")
+	parser.add_argument("--no-cache", action="store_true", help="""Neither read
+	nor write the cache.""")
 	args = parser.parse_args()
+	if args.api_rate <= 0:
+		improper_usage("--api-rate must be positive\n", parser)
+	if args.jobs < 1 or args.per_host < 1:
+		improper_usage("--jobs and --per-host must be at least 1\n", parser)
+	if args.retries < 0 or (args.pool_size is not None and args.pool_size < 1):
+		improper_usage("--retries must be non-negative and --pool-size positive\n", parser)
 	try:
 		main(args)
 	except KeyboardInterrupt:
@@ -5,6 +5,30 @@ import json
 from pprint import pprint
 import os
 import os.path
+import collections
+import sqlite3
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+# Riot's development key limits: (requests, per seconds). All must hold.
+RATE_LIMITS = ((10, 10), (500, 600))
+
+# --monitor polls this often (seconds) while homies are playing, backing off
+# to MAX_POLL_INTERVAL while nobody is.
+MIN_POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 15 * 60
+MONITOR_STATE_FILE = "monitor_state.json"
+STORE_FILE = "games.sqlite"
+
+# Most names the summoner-by-name endpoint takes per call.
+SUMMONER_NAMES_PER_CALL = 40
+# Summoners can rename, so resolved names are looked up again after this long.
+NAME_CACHE_TTL = 7 * 24 * 60 * 60
+# Only this many recent-games latencies are kept for the summary, since a
+# monitor can poll for days.
+LATENCY_SAMPLES = 1000
 
 
 class Homie(object):
@@ -23,6 +47,135 @@ class Homie(object):
 		return d
 
 
+class RateLimiter(object):
+	"""Sliding-window rate limiter shared by every thread talking to the API.
+
+	acquire() blocks until a request can be sent without breaking any of the
+	(requests, seconds) limits, so a pool of workers fills the budget instead
+	of each one waiting its turn."""
+	def __init__(self, limits):
+		self.limits = limits
+		self.window = max(seconds for _, seconds in limits)
+		self.sent = collections.deque()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self.lock:
+				now = time.time()
+				while self.sent and now - self.sent[0] >= self.window:
+					self.sent.popleft()
+				wait = 0
+				for count, seconds in self.limits:
+					recent = [t for t in self.sent if now - t < seconds]
+					if len(recent) >= count:
+						wait = max(wait, recent[-count] + seconds - now)
+				if wait <= 0:
+					self.sent.append(now)
+					return
+			time.sleep(wait)
+
+
+class GameIndex(object):
+	"""Every game seen, keyed by gameId, with the homies known to have played it.
+
+	A game shows up once in the recent games of each homie who played it, but
+	each copy lists all the other players, so the first copy is enough to work
+	out who was there. Later copies only add their owner, keeping the cost per
+	game proportional to its player count, not to how many homies played it."""
+	def __init__(self):
+		self.games = {}
+		self.members = {}
+
+	def __len__(self):
+		return len(self.games)
+
+	def __contains__(self, game_id):
+		return game_id in self.games
+
+	def add(self, homie_id, game, homie_ids):
+		"""Record that homie_id played game. Returns the game's homie count,
+		counting only players in homie_ids."""
+		game_id = game[u"gameId"]
+		members = self.members.get(game_id)
+		if members is None:
+			self.games[game_id] = game
+			members = set(player[u"summonerId"] for player in game[u"fellowPlayers"]
+				if player[u"summonerId"] in homie_ids)
+			self.members[game_id] = members
+		# Stored games may belong to summoners no longer in the roster.
+		if homie_id in homie_ids:
+			members.add(homie_id)
+		return len(members)
+
+	def homie_count(self, game_id):
+		return len(self.members[game_id])
+
+
+class GameStore(object):
+	"""Everything fetched so far, kept in a SQLite file in the output directory.
+
+	Each game is stored once (as JSON), along with which homies' recent games
+	it turned up in, which is enough to rebuild a GameIndex over the whole
+	history without the API. Resolved summoner names are kept too. Only the
+	main thread uses the store."""
+	def __init__(self, path):
+		self.conn = sqlite3.connect(path)
+		with self.conn:
+			self.conn.execute("""CREATE TABLE IF NOT EXISTS games
+				(game_id INTEGER PRIMARY KEY, create_date INTEGER, data TEXT)""")
+			self.conn.execute("""CREATE TABLE IF NOT EXISTS appearances
+				(game_id INTEGER, homie_id INTEGER, PRIMARY KEY (game_id, homie_id))""")
+			self.conn.execute("""CREATE TABLE IF NOT EXISTS summoners
+				(lower_name TEXT PRIMARY KEY, name TEXT, id INTEGER, resolved REAL)""")
+			columns = [row[1] for row in self.conn.execute("PRAGMA table_info(summoners)")]
+			if "resolved" not in columns:
+				self.conn.execute("ALTER TABLE summoners ADD COLUMN resolved REAL DEFAULT 0")
+
+	def add_games(self, homie_id, games):
+		with self.conn:
+			self.conn.executemany("INSERT OR IGNORE INTO games VALUES (?, ?, ?)",
+				[(game[u"gameId"], game.get(u"createDate"), json.dumps(game)) for game in games])
+			self.conn.executemany("INSERT OR IGNORE INTO appearances VALUES (?, ?)",
+				[(game[u"gameId"], homie_id) for game in games])
+
+	def appearances(self):
+		"""Yields (homie_id, game) for every stored appearance, oldest first."""
+		query = """SELECT appearances.homie_id, games.data FROM appearances
+			JOIN games ON games.game_id = appearances.game_id
+			ORDER BY games.create_date, games.game_id"""
+		for homie_id, data in self.conn.execute(query):
+			yield homie_id, json.loads(data)
+
+	def summoners(self, names, max_age=None):
+		"""Returns {standardized name: (name, id)} for those of names resolved
+		before, leaving out any resolved more than max_age seconds ago."""
+		oldest = 0 if max_age is None else time.time() - max_age
+		found = {}
+		for name in names:
+			row = self.conn.execute("SELECT name, id FROM summoners WHERE lower_name = ? AND resolved >= ?",
+				(standardize_name(name), oldest)).fetchone()
+			if row:
+				found[standardize_name(name)] = row
+		return found
+
+	def add_summoners(self, summoners):
+		now = time.time()
+		with self.conn:
+			self.conn.executemany("INSERT OR REPLACE INTO summoners VALUES (?, ?, ?, ?)",
+				[(standardize_name(name), name, id, now) for name, id in summoners])
+
+
+def standardize_name(name):
+	"""Summoner names the way Riot compares them: lowercase, without spaces."""
+	return name.lower().replace(u" ", u"")
+
+
+def percentile(sorted_values, fraction):
+	index = int(round(fraction * (len(sorted_values) - 1)))
+	return sorted_values[index]
+
+
 def pprint_to_string(obj, strip=False):
 	from cStringIO import StringIO
 	stringf = StringIO()
@@ -46,7 +199,15 @@ class Model(object):
 		self.threshold = 4
 		self.gen_config = False
 		self.monitor = args.monitor
+		self.offline = args.offline
 		self.output_dir = args.output_dir
+		self.store = None
+		self.workers = args.workers
+		self.limiter = RateLimiter(RATE_LIMITS)
+		self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+		self.games = GameIndex()
+		self.seen_games = {}
+		self.reported = set()
 		if args.config:
 			self.read_config(args.config)
 		if args.key:
@@ -62,7 +223,9 @@ class Model(object):
 		if not args.threshold is None:
 			self.threshold = args.threshold
 		if self.key:
-			self.api = riotwatcher.RiotWatcher(self.key, enforce_limits=True)
+			# self.limiter paces requests across threads; riotwatcher's own
+			# bookkeeping isn't thread safe.
+			self.api = riotwatcher.RiotWatcher(self.key, enforce_limits=False)
 	
 	def __str__(self):
 		l = []
@@ -133,45 +296,154 @@ class Model(object):
 	def homie_ids(self):
 		return self.homies_by_id.keys()
 	
+	def fetch_summoners(self, names):
+		"""Look up one chunk of names. A failed lookup is reported and resolves
+		nothing, so it doesn't cost the other chunks their names."""
+		self.limiter.acquire()
+		try:
+			return self.api.get_summoners(names)
+		except Exception as e:
+			# The API answers 404 when none of the names exist.
+			if isinstance(e, riotwatcher.LoLException) and e.error == riotwatcher.error_404:
+				return {}
+			sys.stderr.write("Looking up {} summoner names failed: {}\n".format(len(names), e))
+			return {}
+
 	def resolve_homie_names(self):
-		#Try to resolve names to IDs
-		if self.homie_names:
-			json = self.api.get_summoners(self.homie_names)
-			if json:
-				lower_homie_names = {name.lower(): name for name in self.homie_names}
-				for key in json:
-					homie_id = json[key][u"id"]
-					homie_name = json[key][u"name"]
-					homie = Homie(homie_name, homie_id)
-					self.homies_by_id[homie_id] = homie
-					if homie_name.lower() in lower_homie_names:
-						self.homie_names.remove(lower_homie_names[homie_name.lower()])
+		"""Turn homie_names into homies. Names resolved within NAME_CACHE_TTL
+		come from the store (any age, when offline); the rest are looked up
+		SUMMONER_NAMES_PER_CALL at a time, several calls at once. Names that
+		can't be resolved stay in homie_names."""
+		names = list(self.homie_names)
+		resolved = {}
+		if self.store:
+			resolved.update(self.store.summoners(names, None if self.offline else NAME_CACHE_TTL))
+		unresolved = [name for name in names if standardize_name(name) not in resolved]
+		if unresolved and not self.offline:
+			chunks = [unresolved[i:i + SUMMONER_NAMES_PER_CALL]
+				for i in range(0, len(unresolved), SUMMONER_NAMES_PER_CALL)]
+			fetched = []
+			pool = ThreadPool(min(self.workers, len(chunks)))
+			try:
+				for json in pool.imap_unordered(self.fetch_summoners, chunks):
+					for key in json or {}:
+						fetched.append((json[key][u"name"], json[key][u"id"]))
+			finally:
+				pool.close()
+				pool.join()
+			for name, id in fetched:
+				resolved[standardize_name(name)] = (name, id)
+			if self.store and fetched:
+				self.store.add_summoners(fetched)
+		for name, id in resolved.values():
+			self.homies_by_id[id] = Homie(name, id)
+		self.homie_names = set(name for name in names if standardize_name(name) not in resolved)
 	
+	def fetch_recent_games(self, homie):
+		self.limiter.acquire()
+		start = time.time()
+		response = self.api.get_recent_games(homie.id)
+		return homie, response, time.time() - start
+
 	def update_homie_games(self):
-		for homie in self.homies():
-			response = self.api.get_recent_games(homie.id)
-			if response:
-				homie.recent_games = response[u"games"]
+		"""Fetch everyone's recent games and index those not seen before.
+		Returns the number of unseen games and the set of new inhouse ids."""
+		new_games = 0
+		new_inhouses = set()
+		pool = ThreadPool(self.workers)
+		try:
+			for homie, response, latency in pool.imap_unordered(self.fetch_recent_games, list(self.homies())):
+				self.latencies.append(latency)
+				if response:
+					homie.recent_games = response[u"games"]
+					seen = self.seen_games.get(homie.id, set())
+					unseen = [game for game in homie.recent_games if game[u"gameId"] not in seen]
+					new_games += len(unseen)
+					new_inhouses |= self.add_games(homie, unseen)
+					# Only the recent window can come back, so that's all worth remembering.
+					self.seen_games[homie.id] = set(game[u"gameId"] for game in homie.recent_games)
+		finally:
+			pool.close()
+			pool.join()
+		return new_games, new_inhouses
+
+	def latency_summary(self):
+		if not self.latencies:
+			return "No requests made"
+		latencies = sorted(self.latencies)
+		return "{n} requests: median {median:.0f}ms, p95 {p95:.0f}ms, max {max:.0f}ms".format(
+			n=len(latencies),
+			median=percentile(latencies, 0.5) * 1000,
+			p95=percentile(latencies, 0.95) * 1000,
+			max=latencies[-1] * 1000)
 	
-	def identify_inhouses(self):
-		inhouses = set()
+	def open_store(self):
+		self.store = GameStore(os.path.join(self.output_dir, STORE_FILE))
+
+	def load_stored_games(self):
+		"""Index every game in the store. Run after names are resolved, since
+		which players count as homies is worked out as games are indexed."""
 		homie_id_set = frozenset(self.homie_ids())
-		for homie in self.homies():
-			for game in homie.recent_games:
-				is_classic = (game[u"gameMode"] == u"CLASSIC")
-				is_custom = (game[u"gameType"] == u"CUSTOM_GAME")
-				game_player_ids = set()
-				game_player_ids.add(homie.id)
-				game_id = game[u"gameId"]
-				for player in game[u"fellowPlayers"]:
-					game_player_ids.add(player[u'summonerId'])
-				if len(game_player_ids & homie_id_set) >= self.threshold:
-					if self.custom_only and not is_custom:
-						continue
-					if self.classic_only and not is_classic:
-						continue
-					inhouses.add(game[u"gameId"])
-		return inhouses
+		for homie_id, game in self.store.appearances():
+			self.games.add(homie_id, game, homie_id_set)
+
+	def add_games(self, homie, games):
+		"""Index (and store) a homie's games. Returns the ids of games that
+		became inhouses."""
+		if self.store:
+			self.store.add_games(homie.id, games)
+		homie_id_set = frozenset(self.homie_ids())
+		new_inhouses = set()
+		for game in games:
+			game_id = game[u"gameId"]
+			was_inhouse = game_id in self.games and self.is_inhouse(game_id)
+			self.games.add(homie.id, game, homie_id_set)
+			if not was_inhouse and self.is_inhouse(game_id):
+				new_inhouses.add(game_id)
+		return new_inhouses
+
+	def is_inhouse(self, game_id):
+		game = self.games.games[game_id]
+		if self.custom_only and game[u"gameType"] != u"CUSTOM_GAME":
+			return False
+		if self.classic_only and game[u"gameMode"] != u"CLASSIC":
+			return False
+		return self.games.homie_count(game_id) >= self.threshold
+
+	def identify_inhouses(self):
+		return set(game_id for game_id in self.games.games if self.is_inhouse(game_id))
+
+	def load_state(self, path):
+		"""Restore what --monitor has already seen and reported, if anything."""
+		try:
+			with open(path) as f:
+				obj = json.load(f)
+		except (IOError, ValueError):
+			return
+		self.seen_games = dict((int(homie_id), set(game_ids)) for homie_id, game_ids in obj[u"seen"].items())
+		self.reported = set(obj[u"reported"])
+
+	def save_state(self, path):
+		d = {}
+		d[u"version"] = "0.1"
+		d[u"seen"] = dict((homie_id, sorted(game_ids)) for homie_id, game_ids in self.seen_games.items())
+		d[u"reported"] = sorted(self.reported)
+		temp_path = path + ".tmp"
+		with open(temp_path, "w") as f:
+			json.dump(d, f)
+		os.rename(temp_path, path)
+
+	def write_inhouse(self, game_id):
+		"""Save an inhouse game and who played in it. Returns the file's path."""
+		d = {}
+		d[u"gameId"] = game_id
+		d[u"homies"] = [self.homies_by_id[homie_id].json_dict()
+			for homie_id in sorted(self.games.members[game_id]) if homie_id in self.homies_by_id]
+		d[u"game"] = self.games.games[game_id]
+		path = os.path.join(self.output_dir, "inhouse-{}.json".format(game_id))
+		with open(path, "w") as f:
+			json.dump(d, f, sort_keys=True, indent=4, separators=(',', ': '))
+		return path
 		
 
 def make_output_dir(path):
@@ -186,6 +458,33 @@ def make_output_dir(path):
 		return True
 
 
+def monitor(model):
+	"""Poll for new games until interrupted, writing inhouses as they appear.
+
+	Polls every MIN_POLL_INTERVAL seconds while any homie has a new game and
+	doubles the wait (up to MAX_POLL_INTERVAL) each time nobody does. What has
+	been seen and reported is kept in the output directory between runs."""
+	state_path = os.path.join(model.output_dir, MONITOR_STATE_FILE)
+	model.load_state(state_path)
+	interval = MIN_POLL_INTERVAL
+	while True:
+		try:
+			new_games, new_inhouses = model.update_homie_games()
+		except Exception as e:
+			sys.stderr.write("Polling failed: {}\n".format(e))
+			new_games, new_inhouses = 0, set()
+		for game_id in sorted(new_inhouses - model.reported):
+			print "New inhouse {} saved to {}".format(game_id, model.write_inhouse(game_id))
+			sys.stdout.flush()
+		model.reported |= new_inhouses
+		model.save_state(state_path)
+		if new_games:
+			interval = MIN_POLL_INTERVAL
+		else:
+			interval = min(interval * 2, MAX_POLL_INTERVAL)
+		time.sleep(interval)
+
+
 def main(model):
 	#set up the output directory
 	if model.output_dir:
@@ -198,8 +497,20 @@ def main(model):
 		model.write_config(sys.stdout)
 		sys.exit(0)
 	
+	if model.output_dir:
+		model.open_store()
 	model.resolve_homie_names()
-	model.update_homie_games()
+	if model.store:
+		model.load_stored_games()
+	if model.monitor:
+		try:
+			monitor(model)
+		except KeyboardInterrupt:
+			sys.exit(0)
+
+	if not model.offline:
+		model.update_homie_games()
+		sys.stderr.write("Recent games: {}\n".format(model.latency_summary()))
 	inhouses = model.identify_inhouses()
 	
 	print "Games played with bros"
@@ -211,7 +522,9 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--gen-config", action="store_true", help="Generate a config file for later use with --config. The file is written to stdout. This file contains your key, so keep it safe.")
 	parser.add_argument("--monitor", action="store_true", help="Periodically check for games and emit output as new games are detected.")
-	parser.add_argument("--output-dir", help="Directory to save game data into.")
+	parser.add_argument("--output-dir", help="Directory to save game data into. Games fetched on earlier runs are read back from it, so inhouses are found across the whole saved history.")
+	parser.add_argument("--offline", action="store_true", help="Don't call the API; look for inhouses in the games saved in --output-dir.")
+	parser.add_argument("--workers", "-w", type=int, default=4, help="Number of summoners to fetch games for at once. Requests still share one rate limit.")
 	config_group = parser.add_argument_group("Configuration options", description="Arguments can be written to a configuration file using --gen-config and reused later with --config. Options supplied on the command line take precedence over those supplied in the config file.")
 	game_modes_group = config_group.add_mutually_exclusive_group()
 	game_modes_group.add_argument("--all-game-modes", dest="classic_only", action="store_false", help="Include games from all game modes")
@@ -225,9 +538,15 @@ if __name__ == "__main__":
 	config_group.add_argument("--threshold", "-t", type=int, default=None, help="Threshold for how many games it takes to be an inhouse game")
 	args = parser.parse_args()
 	model = Model(args)
-	if not model.key:
+	if not model.key and not model.offline:
 		parser.error("A key is required")
+	if model.offline and (model.monitor or not model.output_dir):
+		parser.error("--offline needs --output-dir and can't be used with --monitor")
 	if model.threshold < 0 or model.threshold > 10:
 		parser.error("Threshold must be 0 <= threshold <= 10")
+	if model.workers < 1:
+		parser.error("--workers must be at least 1")
+	if model.monitor and not model.output_dir:
+		parser.error("--monitor needs an --output-dir to write games and its state into")
 	main(model) 
 
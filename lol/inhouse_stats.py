@@ -0,0 +1,268 @@
+"""Aggregate statistics over the games saved by inhouse_finder.py.
+
+Games are flattened into NumPy arrays with one row per player per game, and
+from those into game x homie matrices, so questions like "how often do these
+two play together, and how often do they win when they do" are a matrix
+product over the whole history instead of a walk through nested dicts.
+Needs NumPy; `--benchmark 100000` times it on synthetic data.
+"""
+
+from __future__ import print_function, division
+
+import sys
+import argparse
+import json
+import os.path
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+
+# Must match inhouse_finder.STORE_FILE.
+STORE_FILE = "games.sqlite"
+TEAMS = (100, 200)
+
+
+def owned_games_from_index(index):
+	"""Yields (owner_id, game) for each game in an inhouse_finder GameIndex.
+
+	The copy of a game the index keeps lists everyone but its owner in
+	fellowPlayers, so the owner is the one homie that isn't listed."""
+	for game_id, game in index.games.items():
+		fellows = set(player[u"summonerId"] for player in game[u"fellowPlayers"])
+		for homie_id in index.members[game_id] - fellows:
+			yield homie_id, game
+
+
+def owned_games_from_store(conn):
+	"""Yields (owner_id, game) for each game in an inhouse_finder GameStore."""
+	query = """SELECT appearances.homie_id, games.data FROM appearances
+		JOIN games ON games.game_id = appearances.game_id"""
+	for homie_id, data in conn.execute(query):
+		game = json.loads(data)
+		if all(player[u"summonerId"] != homie_id for player in game[u"fellowPlayers"]):
+			yield homie_id, game
+
+
+class GameTable(object):
+	"""Column store of games, built once and then queried many times.
+
+	Per player per game: game row, summoner id, team, champion and whether
+	that team won. For homies, the same facts are also kept as game x homie
+	0/1 matrices (one per team, plus one for wins), so pair statistics are a
+	single BLAS matrix product each."""
+	def __init__(self, game_ids, game_rows, players, teams, champions, wins, homie_ids):
+		self.game_ids = np.asarray(game_ids, dtype=np.int64)
+		self.game_rows = np.asarray(game_rows, dtype=np.int32)
+		self.players = np.asarray(players, dtype=np.int64)
+		self.teams = np.asarray(teams, dtype=np.int16)
+		self.champions = np.asarray(champions, dtype=np.int32)
+		self.wins = np.asarray(wins, dtype=bool)
+		self.homie_ids = np.array(sorted(homie_ids), dtype=np.int64)
+
+		# Column of each row's player among the homies, or -1.
+		columns = np.searchsorted(self.homie_ids, self.players)
+		columns[columns == len(self.homie_ids)] = 0
+		is_homie = self.homie_ids[columns] == self.players if len(self.homie_ids) else np.zeros(len(self.players), bool)
+		self.homie_columns = np.where(is_homie, columns, -1)
+
+		# float32 so the products below go through BLAS; counts stay exact
+		# well past any realistic number of games.
+		shape = (len(self.game_ids), len(self.homie_ids))
+		rows, cols = self.game_rows[is_homie], self.homie_columns[is_homie]
+		self.on_team = []
+		for team in TEAMS:
+			matrix = np.zeros(shape, dtype=np.float32)
+			on = self.teams[is_homie] == team
+			matrix[rows[on], cols[on]] = 1
+			self.on_team.append(matrix)
+		self.played = self.on_team[0] + self.on_team[1]
+		self.won = np.zeros(shape, dtype=np.float32)
+		won = self.wins[is_homie]
+		self.won[rows[won], cols[won]] = 1
+
+	@classmethod
+	def from_games(cls, owned_games, homie_ids):
+		"""Build from (owner_id, game) pairs, where game is as it appeared in
+		owner_id's recent games. Later copies of a game are ignored."""
+		seen = set()
+		game_ids, game_rows, players, teams, champions, wins = [], [], [], [], [], []
+		for owner_id, game in owned_games:
+			game_id = game[u"gameId"]
+			if game_id in seen:
+				continue
+			seen.add(game_id)
+			row = len(game_ids)
+			game_ids.append(game_id)
+			owner_team = game[u"teamId"]
+			winner = owner_team if game[u"stats"][u"win"] else sum(TEAMS) - owner_team
+			roster = [(owner_id, owner_team, game[u"championId"])]
+			roster.extend((player[u"summonerId"], player[u"teamId"], player[u"championId"])
+				for player in game[u"fellowPlayers"])
+			for summoner_id, team, champion in roster:
+				game_rows.append(row)
+				players.append(summoner_id)
+				teams.append(team)
+				champions.append(champion)
+				wins.append(team == winner)
+		return cls(game_ids, game_rows, players, teams, champions, wins, homie_ids)
+
+	@classmethod
+	def from_store(cls, path):
+		"""Build from an inhouse_finder output directory's games.sqlite. The
+		homies are everyone games were fetched for or whose name was resolved.
+		Returns the table and a {summoner id: name} dict."""
+		conn = sqlite3.connect(path)
+		names = dict((id, name) for name, id in conn.execute("SELECT name, id FROM summoners"))
+		homie_ids = set(row[0] for row in conn.execute("SELECT DISTINCT homie_id FROM appearances"))
+		homie_ids.update(names)
+		table = cls.from_games(owned_games_from_store(conn), homie_ids)
+		conn.close()
+		return table, names
+
+	def __len__(self):
+		return len(self.game_ids)
+
+	def games_played(self):
+		"""Games played by each homie, in homie_ids order."""
+		return self.played.sum(axis=0)
+
+	def win_rates(self):
+		with np.errstate(divide="ignore", invalid="ignore"):
+			return self.won.sum(axis=0) / self.games_played()
+
+	def together(self):
+		"""homies x homies count of games both played, on either team."""
+		return self.played.T.dot(self.played)
+
+	def same_team(self):
+		"""homies x homies count of games both played on the same team."""
+		return self.on_team[0].T.dot(self.on_team[0]) + self.on_team[1].T.dot(self.on_team[1])
+
+	def opposed(self):
+		"""homies x homies count of games played on opposite teams."""
+		return self.on_team[0].T.dot(self.on_team[1]) + self.on_team[1].T.dot(self.on_team[0])
+
+	def pair_win_rates(self):
+		"""homies x homies win rate when on the same team (nan if never)."""
+		with np.errstate(divide="ignore", invalid="ignore"):
+			return self.won.T.dot(self.won) / self.same_team()
+
+	def top_pairs(self, count=10, min_games=1, key="games"):
+		"""[(homie a, homie b, games together as teammates, win rate)] for the
+		`count` pairs with the most games, or the best win rate if key is
+		"win_rate", ignoring pairs with fewer than min_games."""
+		games = self.same_team()
+		rates = self.pair_win_rates()
+		a, b = np.triu_indices(len(self.homie_ids), k=1)
+		keep = games[a, b] >= max(min_games, 1)
+		a, b = a[keep], b[keep]
+		order = rates[a, b] if key == "win_rate" else games[a, b]
+		best = np.argsort(-order, kind="mergesort")[:count]
+		return [(self.homie_ids[a[i]], self.homie_ids[b[i]], int(games[a[i], b[i]]), rates[a[i], b[i]])
+			for i in best]
+
+	def champion_frequencies(self, summoner_id=None, count=10, homies_only=True):
+		"""[(champion id, games)] most played, by one summoner or by all homies
+		(or everyone, if homies_only is False)."""
+		if summoner_id is not None:
+			champions = self.champions[self.players == summoner_id]
+		elif homies_only:
+			champions = self.champions[self.homie_columns >= 0]
+		else:
+			champions = self.champions
+		if not len(champions):
+			return []
+		counts = np.bincount(champions)
+		best = np.argsort(-counts, kind="mergesort")[:count]
+		return [(int(champion), int(counts[champion])) for champion in best if counts[champion]]
+
+
+def synthetic_games(num_games, num_homies=30, num_players=300, num_champions=140, seed=0):
+	"""Yields (owner_id, game) pairs shaped like Riot's recent-games data,
+	each game with two to six homies among ten players."""
+	rng = random.Random(seed)
+	homies = list(range(1, num_homies + 1))
+	others = list(range(num_homies + 1, num_players + 1))
+	for game_id in range(num_games):
+		present = rng.sample(homies, rng.randint(2, 6))
+		roster = present + rng.sample(others, 10 - len(present))
+		rng.shuffle(roster)
+		champions = rng.sample(range(1, num_champions + 1), 10)
+		winner = rng.choice(TEAMS)
+		players = [{u"summonerId": summoner_id, u"teamId": TEAMS[i // 5], u"championId": champions[i]}
+			for i, summoner_id in enumerate(roster)]
+		owner = next(player for player in players if player[u"summonerId"] in present)
+		yield owner[u"summonerId"], {
+			u"gameId": game_id,
+			u"gameMode": u"CLASSIC",
+			u"gameType": u"CUSTOM_GAME",
+			u"teamId": owner[u"teamId"],
+			u"championId": owner[u"championId"],
+			u"stats": {u"win": owner[u"teamId"] == winner},
+			u"fellowPlayers": [player for player in players if player is not owner],
+		}
+
+
+def timed(label, function, repeat=5):
+	"""Run function `repeat` times and print the best time. Returns its result."""
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		result = function()
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	print("{:<24} {:8.2f} ms".format(label, best * 1000))
+	return result
+
+
+def benchmark(num_games):
+	print("Generating {} synthetic games...".format(num_games))
+	games = list(synthetic_games(num_games))
+	homie_ids = range(1, 31)
+	table = timed("build", lambda: GameTable.from_games(games, homie_ids), repeat=1)
+	timed("games_played", table.games_played)
+	timed("win_rates", table.win_rates)
+	timed("together", table.together)
+	timed("same_team", table.same_team)
+	timed("pair_win_rates", table.pair_win_rates)
+	timed("top_pairs", lambda: table.top_pairs(10, 50, key="win_rate"))
+	timed("champion_frequencies", table.champion_frequencies)
+	timed("champions of one homie", lambda: table.champion_frequencies(1))
+
+
+def report(table, names, count, min_games):
+	def name(summoner_id):
+		return names.get(summoner_id, str(summoner_id))
+
+	print("{} games, {} homies".format(len(table), len(table.homie_ids)))
+	print("\nMost games as teammates")
+	for a, b, games, rate in table.top_pairs(count, min_games):
+		print("  {} + {}: {} games, {:.0%} won".format(name(a), name(b), games, rate))
+	print("\nBest win rate as teammates (at least {} games)".format(min_games))
+	for a, b, games, rate in table.top_pairs(count, min_games, key="win_rate"):
+		print("  {} + {}: {:.0%} of {} games".format(name(a), name(b), rate, games))
+	print("\nMost played champions")
+	for champion, games in table.champion_frequencies(count=count):
+		print("  champion {}: {} games".format(champion, games))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Statistics over the games saved by inhouse_finder.py --output-dir.")
+	parser.add_argument("--output-dir", help="The directory inhouse_finder.py saved games into.")
+	parser.add_argument("--top", "-n", type=int, default=10, help="How many pairs and champions to list.")
+	parser.add_argument("--min-games", type=int, default=5, help="Ignore pairs with fewer games together than this when ranking win rates.")
+	parser.add_argument("--benchmark", type=int, metavar="GAMES", help="Time building and querying a table of this many synthetic games (e.g. 100000) instead.")
+	args = parser.parse_args()
+	if args.benchmark:
+		benchmark(args.benchmark)
+		sys.exit(0)
+	if not args.output_dir:
+		parser.error("--output-dir or --benchmark is required")
+	path = os.path.join(args.output_dir, STORE_FILE)
+	if not os.path.exists(path):
+		parser.error("No saved games in {}".format(args.output_dir))
+	table, names = GameTable.from_store(path)
+	report(table, names, args.top, args.min_games)
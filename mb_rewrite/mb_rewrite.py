@@ -7,12 +7,30 @@ or custom personas. Supports interactive mode after initial run.
 """
 
 import argparse
+import atexit
+import hashlib
+import json
+import random
 import sys
 import os
-from typing import List, Dict, Set
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Iterator, List, Dict, Optional, Set, TextIO, Tuple, Union
+import openai
 from openai import OpenAI
 from dotenv import load_dotenv
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 
 # Myers-Briggs personality type descriptions
 MB_DESCRIPTIONS = {
@@ -34,6 +52,57 @@ MB_DESCRIPTIONS = {
     "ESFP": "ESFP (The Entertainer): Spontaneous, enthusiastic, and people-oriented. Values fun and experiences. Communicates with energy and excitement.",
 }
 
+# Model parameters, shared by every rewrite request.
+MODEL = "gpt-4"
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+
+# Every request starts with the same system message, followed by a user
+# message whose persona part comes before the message being rewritten. The
+# longest fixed prefix leads so the provider's prompt cache can reuse it.
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a helpful assistant that rewrites messages to match different communication styles and personalities. "
+               "The rewritten message should reflect how the given persona would naturally communicate, maintaining the core meaning "
+               "but adapting the tone, style, and approach to match their personality."
+}
+PERSONA_PROMPT = "Rewrite the following message as if you were {description}.\n\nOriginal message:\n"
+PROMPT_SUFFIX = "\n\nRewritten message:"
+
+# Most chat-completion requests in flight at once for a single message.
+DEFAULT_CONCURRENCY = 8
+
+# Most rewrites kept in the response cache; the least recently used go first.
+DEFAULT_CACHE_SIZE = 10000
+
+# Retries of a rate-limited or transient API failure, and the backoff between
+# them: a random delay up to BACKOFF_BASE * 2**retry seconds, capped.
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class Persona:
+    """A persona to rewrite messages for, with its part of the prompt built once."""
+    label: str
+    description: str
+    # Shown in menus; the description itself if not given.
+    summary: str = ""
+    prompt_prefix: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.summary = self.summary or self.description
+        self.prompt_prefix = PERSONA_PROMPT.format(description=self.description)
+
+
+MB_PERSONAS = {
+    mb_type: Persona(mb_type, description, description.split(":", 1)[1].strip())
+    for mb_type, description in MB_DESCRIPTIONS.items()
+}
+MB_TYPES = sorted(MB_PERSONAS)
+
 
 def get_client() -> OpenAI:
     """Initialize and return OpenAI client."""
@@ -62,8 +131,8 @@ def validate_mb_type(mb_type: str) -> bool:
     return normalized in MB_DESCRIPTIONS
 
 
-def build_persona_description(mb_types: List[str], custom_personas: List[str]) -> List[Dict[str, str]]:
-    """Build list of persona descriptions from MB types and custom personas."""
+def build_persona_description(mb_types: List[str], custom_personas: List[str]) -> List[Persona]:
+    """Build list of personas from MB types and custom persona descriptions."""
     personas = []
     
     for mb_type in mb_types:
@@ -71,16 +140,10 @@ def build_persona_description(mb_types: List[str], custom_personas: List[str]) -
         if not validate_mb_type(normalized):
             print(f"Warning: Invalid Myers-Briggs type '{mb_type}'. Skipping.", file=sys.stderr)
             continue
-        personas.append({
-            "label": normalized,
-            "description": MB_DESCRIPTIONS[normalized]
-        })
+        personas.append(MB_PERSONAS[normalized])
     
     for i, custom in enumerate(custom_personas, start=1):
-        personas.append({
-            "label": f"Custom {i}",
-            "description": custom
-        })
+        personas.append(Persona(f"Custom {i}", custom))
     
     return personas
 
@@ -94,7 +157,7 @@ def display_persona_menu(selected_mb_types: Set[str], custom_personas: List[str]
     if selected_mb_types:
         print("\nMyers-Briggs Types:")
         for mb_type in sorted(selected_mb_types):
-            print(f"  • {mb_type} - {MB_DESCRIPTIONS[mb_type].split(':')[1].strip()}")
+            print(f"  • {mb_type} - {MB_PERSONAS[mb_type].summary}")
     else:
         print("\nMyers-Briggs Types: (none selected)")
     
@@ -114,15 +177,13 @@ def display_mb_types_menu():
     print("Available Myers-Briggs Personality Types:")
     print("="*70)
     
-    mb_list = sorted(MB_DESCRIPTIONS.keys())
-    for i, mb_type in enumerate(mb_list, start=1):
-        desc = MB_DESCRIPTIONS[mb_type].split(':')[1].strip()
-        print(f"{i:2d}. {mb_type:4s} - {desc}")
+    for i, mb_type in enumerate(MB_TYPES, start=1):
+        print(f"{i:2d}. {mb_type:4s} - {MB_PERSONAS[mb_type].summary}")
     
     print("="*70)
 
 
-def interactive_persona_selection() -> List[Dict[str, str]]:
+def interactive_persona_selection() -> List[Persona]:
     """Interactive menu for selecting personas."""
     selected_mb_types: Set[str] = set()
     custom_personas: List[str] = []
@@ -149,7 +210,7 @@ def interactive_persona_selection() -> List[Dict[str, str]]:
                 # Check if it's a number
                 try:
                     mb_num = int(mb_input)
-                    mb_list = sorted(MB_DESCRIPTIONS.keys())
+                    mb_list = MB_TYPES
                     if 1 <= mb_num <= len(mb_list):
                         mb_type = mb_list[mb_num - 1]
                         if mb_type in selected_mb_types:
@@ -243,59 +304,439 @@ def interactive_persona_selection() -> List[Dict[str, str]]:
     return build_persona_description(list(selected_mb_types), custom_personas)
 
 
-def rewrite_message(client: OpenAI, message: str, persona: Dict[str, str]) -> str:
-    """Rewrite a message for a specific persona using OpenAI."""
-    prompt = f"""Rewrite the following message as if you were {persona['description']}.
+def completion_request(message: str, persona: Persona) -> Dict[str, Any]:
+    """Build the chat-completion arguments for rewriting a message for a persona."""
+    return {
+        "model": MODEL,
+        "messages": [
+            SYSTEM_MESSAGE,
+            {"role": "user", "content": persona.prompt_prefix + message + PROMPT_SUFFIX}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+
+
+@lru_cache(maxsize=None)
+def token_encoding() -> Any:
+    """Return MODEL's tokenizer, or None if tiktoken or its data is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(MODEL)
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the tokens in some text: exact with tiktoken, else about four characters each."""
+    encoding = token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Tokens each chat message costs beyond its content, and that every reply is primed with.
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
 
-The rewritten message should reflect how this persona would naturally communicate, maintaining the core meaning but adapting the tone, style, and approach to match their personality.
 
-Original message:
-{message}
+def estimate_prompt_tokens(message: str, persona: Persona) -> int:
+    """Estimate the prompt tokens of completion_request(message, persona)."""
+    request = completion_request(message, persona)
+    return TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + estimate_tokens(m["content"])
+                                  for m in request["messages"])
+
+
+def default_cache_path() -> str:
+    """Return the response cache location, under $XDG_CACHE_HOME or ~/.cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "mb_rewrite", "responses.sqlite")
+
+
+class ResponseCache:
+    """Persistent cache of rewrites, keyed by a hash of the full completion request.
+
+    The key covers the prompt (and with it the message and persona
+    description), system message, model, temperature and max_tokens, so
+    changing any of them misses. At most `max_entries` rewrites are kept,
+    evicting the least recently used. Stored in SQLite, so a batch run and an
+    interactive session can use it at the same time, with a connection for
+    each of the threads fanning a message out to personas.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS responses
+                (key TEXT PRIMARY KEY, response TEXT, created REAL, used REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(request: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, request: Dict[str, Any]) -> Optional[str]:
+        """Return the cached rewrite for a completion request, or None."""
+        key = self.key(request)
+        with self.connection() as conn:
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def put(self, request: Dict[str, Any], response: str):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                         (self.key(request), response, now, now))
+            conn.execute("""DELETE FROM responses WHERE key IN
+                (SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)""",
+                         (self.max_entries,))
+
+
+class RewriteError(Exception):
+    """A rewrite that could not be produced, after any retries."""
+
+
+class CallMetrics:
+    """Latency, retries and token usage of chat-completion calls, for tuning --concurrency.
+
+    Latency is per call, from the first attempt to the last, so it includes
+    any time spent backing off.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies = []
+        self.retries = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, latency: float, retries: int, usage: Any = None, failed: bool = False):
+        with self.lock:
+            self.latencies.append(latency)
+            self.retries += retries
+            self.failures += failed
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+
+    def summary(self) -> str:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.perf_counter() - self.started
+            if not latencies:
+                return "No API calls made."
+            
+            def percentile(p: float) -> float:
+                return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+            
+            return (f"{len(latencies)} API calls ({self.failures} failed, {self.retries} retries) in {elapsed:.1f}s\n"
+                    f"  latency: p50 {percentile(50):.2f}s, p95 {percentile(95):.2f}s, max {latencies[-1]:.2f}s\n"
+                    f"  tokens: {self.prompt_tokens} prompt + {self.completion_tokens} completion "
+                    f"({self.completion_tokens / elapsed:.0f} completion tokens/s)")
 
-Rewritten message:"""
 
+def retry_after(error: Exception) -> Optional[float]:
+    """Return the seconds an API error response asks us to wait, if it says."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that rewrites messages to match different communication styles and personalities."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error: Failed to rewrite message - {str(e)}"
-
-
-def format_output(personas: List[Dict[str, str]], message: str, rewritten_messages: List[str]):
-    """Format the output for easy copying and pasting."""
+        return float(response.headers["retry-after-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an API error is a rate limit or transient failure worth retrying."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    return False
+
+
+class ChatClient:
+    """Request layer over the OpenAI client.
+
+    Retries rate-limited and transient failures with full-jitter exponential
+    backoff, waiting at least as long as any retry-after hint, and records
+    every call in `metrics`. Failures that are not retried, or still fail
+    after `max_retries`, are raised as RewriteError.
+    """
+
+    def __init__(self, client: OpenAI, max_retries: int = DEFAULT_RETRIES,
+                 metrics: Optional[CallMetrics] = None):
+        # Retries are ours, so they can be counted and jittered.
+        self.client = client.with_options(max_retries=0)
+        self.max_retries = max_retries
+        self.metrics = metrics or CallMetrics()
+
+    def backoff(self, error: Exception, retries: int) -> float:
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** retries))
+        hint = retry_after(error)
+        if hint is not None:
+            delay = max(delay, hint + random.uniform(0, BACKOFF_BASE))
+        return delay
+
+    def _call(self, attempt: Callable[[], Tuple[str, Any]], can_retry: Callable[[], bool]) -> str:
+        start = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                text, usage = attempt()
+            except Exception as e:
+                if retries < self.max_retries and is_retryable(e) and can_retry():
+                    time.sleep(self.backoff(e, retries))
+                    retries += 1
+                    continue
+                self.metrics.record(time.perf_counter() - start, retries, failed=True)
+                raise RewriteError(str(e) or type(e).__name__) from e
+            self.metrics.record(time.perf_counter() - start, retries, usage)
+            return text
+
+    def complete(self, request: Dict[str, Any]) -> str:
+        """Make a chat-completion request and return the reply text."""
+        def attempt() -> Tuple[str, Any]:
+            response = self.client.chat.completions.create(**request)
+            return response.choices[0].message.content.strip(), response.usage
+        
+        return self._call(attempt, lambda: True)
+
+    def stream(self, request: Dict[str, Any], on_text: Callable[[str], None]) -> str:
+        """Make a streamed chat-completion request, passing each piece of text to
+        `on_text` as it arrives, and return the whole reply.
+
+        A failure is only retried if no text has been passed on yet.
+        """
+        parts = []
+        
+        def attempt() -> Tuple[str, Any]:
+            usage = None
+            stream = self.client.chat.completions.create(
+                **request, stream=True, stream_options={"include_usage": True})
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                text = chunk.choices[0].delta.content
+                if not parts:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                parts.append(text)
+                on_text(text)
+            return "".join(parts).strip(), usage
+        
+        return self._call(attempt, lambda: not parts)
+
+
+def rewrite_message(client: ChatClient, message: str, persona: Persona,
+                    cache: Optional[ResponseCache] = None) -> str:
+    """Rewrite a message for a specific persona using OpenAI.
+
+    Raises RewriteError if the API call fails.
+    """
+    request = completion_request(message, persona)
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            return cached
+    
+    rewritten = client.complete(request)
+    if cache is not None:
+        cache.put(request, rewritten)
+    return rewritten
+
+
+def stream_rewrite(client: ChatClient, message: str, persona: Persona,
+                   on_text: Callable[[str], None], cache: Optional[ResponseCache] = None) -> str:
+    """Rewrite a message for a persona, passing each piece of text to `on_text` as it arrives.
+
+    Returns the complete rewrite, as rewrite_message would. A cached rewrite
+    is passed to `on_text` all at once.
+    """
+    request = completion_request(message, persona)
+    if cache is not None:
+        cached = cache.get(request)
+        if cached is not None:
+            on_text(cached)
+            return cached
+    
+    rewritten = client.stream(request, on_text)
+    if cache is not None:
+        cache.put(request, rewritten)
+    return rewritten
+
+
+def print_original(message: str):
+    """Print the banner that heads the rewrites of a message."""
     print("\n" + "="*70)
     print(f"Original message: {message}")
     print("="*70 + "\n")
+
+
+def format_output(personas: List[Persona], message: str,
+                  rewritten_messages: List[Union[str, RewriteError]]):
+    """Format the output for easy copying and pasting."""
+    print_original(message)
     
     for persona, rewritten in zip(personas, rewritten_messages):
-        print(f"[{persona['label']}]")
+        print(f"[{persona.label}]")
         print("-" * 70)
-        print(rewritten)
+        if isinstance(rewritten, RewriteError):
+            print(f"(Rewrite failed: {rewritten})")
+        else:
+            print(rewritten)
         print()
 
 
-def process_message(client: OpenAI, message: str, personas: List[Dict[str, str]]):
+def rewrite_all(client: ChatClient, message: str, personas: List[Persona],
+                concurrency: int = DEFAULT_CONCURRENCY,
+                cache: Optional[ResponseCache] = None) -> List[Union[str, RewriteError]]:
+    """Rewrite a message for every persona, with up to `concurrency` requests in flight.
+
+    Results are returned in persona order, whichever request finishes first.
+    A rewrite that failed is returned as its RewriteError.
+    """
+    def rewrite_one(persona: Persona) -> Union[str, RewriteError]:
+        try:
+            return rewrite_message(client, message, persona, cache)
+        except RewriteError as e:
+            return e
+    
+    if concurrency <= 1 or len(personas) <= 1:
+        return [rewrite_one(persona) for persona in personas]
+    
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(personas))) as pool:
+        return list(pool.map(rewrite_one, personas))
+
+
+class SectionPrinter:
+    """Prints rewrites streamed concurrently as labelled sections, in persona order.
+
+    The first unfinished section is written out as its text arrives. Text for
+    later sections is held back and flushed as soon as every section before
+    them is complete, so sections never interleave and output starts with the
+    first persona's first token.
+    """
+
+    def __init__(self, personas: List[Persona], out: Optional[TextIO] = None):
+        self.personas = personas
+        self.out = out or sys.stdout
+        self.pending = [[] for _ in personas]
+        self.finished = [False] * len(personas)
+        self.current = 0
+        self.lock = threading.Lock()
+        if personas:
+            self._start_section()
+
+    def _start_section(self):
+        self.out.write(f"[{self.personas[self.current].label}]\n")
+        self.out.write("-" * 70 + "\n")
+        self.out.write("".join(self.pending[self.current]))
+        self.pending[self.current] = []
+        self.out.flush()
+
+    def write(self, index: int, text: str):
+        """Add text to the section for personas[index]."""
+        with self.lock:
+            if index == self.current:
+                self.out.write(text)
+                self.out.flush()
+            else:
+                self.pending[index].append(text)
+
+    def finish(self, index: int):
+        """Mark the section for personas[index] complete."""
+        with self.lock:
+            self.finished[index] = True
+            while self.current < len(self.personas) and self.finished[self.current]:
+                self.out.write("\n\n")
+                self.current += 1
+                if self.current < len(self.personas):
+                    self._start_section()
+            self.out.flush()
+
+
+def stream_all(client: ChatClient, message: str, personas: List[Persona],
+               concurrency: int = DEFAULT_CONCURRENCY, out: Optional[TextIO] = None,
+               cache: Optional[ResponseCache] = None) -> List[Union[str, RewriteError]]:
+    """Rewrite a message for every persona concurrently, printing each rewrite as it streams in.
+
+    Returns the rewrites in persona order, with a failed one as its RewriteError.
+    """
+    printer = SectionPrinter(personas, out)
+    
+    def stream_one(index: int) -> Union[str, RewriteError]:
+        written = []
+        
+        def on_text(text: str):
+            written.append(text)
+            printer.write(index, text)
+        
+        try:
+            return stream_rewrite(client, message, personas[index], on_text, cache)
+        except RewriteError as e:
+            prefix = "\n" if written else ""
+            printer.write(index, f"{prefix}(Rewrite failed: {e})")
+            return e
+        finally:
+            printer.finish(index)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(personas)))) as pool:
+        return list(pool.map(stream_one, range(len(personas))))
+
+
+def process_message(client: ChatClient, message: str, personas: List[Persona],
+                    concurrency: int = DEFAULT_CONCURRENCY, stream: bool = False,
+                    cache: Optional[ResponseCache] = None):
     """Process a single message for all personas."""
     if not message.strip():
         return
     
-    rewritten_messages = []
-    for persona in personas:
-        rewritten = rewrite_message(client, message, persona)
-        rewritten_messages.append(rewritten)
+    if stream:
+        print_original(message)
+        stream_all(client, message, personas, concurrency, cache=cache)
+        return
     
+    rewritten_messages = rewrite_all(client, message, personas, concurrency, cache)
     format_output(personas, message, rewritten_messages)
 
 
-def interactive_mode(client: OpenAI, personas: List[Dict[str, str]]):
+def interactive_mode(client: ChatClient, personas: List[Persona],
+                     concurrency: int = DEFAULT_CONCURRENCY, stream: bool = False,
+                     cache: Optional[ResponseCache] = None):
     """Enter interactive mode to process multiple messages."""
     print("\n" + "="*70)
     print("Interactive mode. Enter messages to rewrite (Ctrl+D or Ctrl+C to exit).")
@@ -306,7 +747,7 @@ def interactive_mode(client: OpenAI, personas: List[Dict[str, str]]):
             try:
                 message = input("Message: ").strip()
                 if message:
-                    process_message(client, message, personas)
+                    process_message(client, message, personas, concurrency, stream, cache)
             except EOFError:
                 print("\nExiting interactive mode.")
                 break
@@ -317,6 +758,142 @@ def interactive_mode(client: OpenAI, personas: List[Dict[str, str]]):
         print("\n\nExiting interactive mode.")
 
 
+def read_batch(source: TextIO) -> Iterator[Dict[str, str]]:
+    """Yield {"id", "message"} for each non-blank line of a batch input.
+
+    A line is either the message itself or a JSON object with a "message"
+    and optionally an "id". Messages without an id are identified by their
+    line number, so resuming needs the same input file.
+    """
+    for number, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict) and isinstance(record.get("message"), str):
+                yield {"id": str(record.get("id", number)), "message": record["message"]}
+                continue
+        yield {"id": str(number), "message": line}
+
+
+def completed_pairs(path: str) -> Set[Tuple[str, str]]:
+    """Return the (message id, persona description) pairs already rewritten in a batch output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short when an earlier run was killed.
+                continue
+            if "rewrite" in record:
+                done.add((record["id"], record["description"]))
+    return done
+
+
+def open_batch_output(path: str) -> TextIO:
+    """Open a batch output file for appending, finishing off any line left cut short."""
+    out = open(path, "a+", encoding="utf-8")
+    if out.tell():
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")
+    return out
+
+
+def estimate_batch(source: TextIO, personas: List[Persona], output: Optional[str] = None) -> Dict[str, int]:
+    """Estimate the requests and tokens a batch run would use, without calling the API.
+
+    Pairs already rewritten in `output` are counted as skipped. Completion
+    tokens are an upper bound, MAX_TOKENS per request.
+    """
+    done = completed_pairs(output) if output else set()
+    persona_tokens = [estimate_prompt_tokens("", persona) for persona in personas]
+    totals = {"requests": 0, "skipped": 0, "prompt_tokens": 0}
+    for item in read_batch(source):
+        message_tokens = estimate_tokens(item["message"])
+        for persona, tokens in zip(personas, persona_tokens):
+            if (item["id"], persona.description) in done:
+                totals["skipped"] += 1
+                continue
+            totals["requests"] += 1
+            totals["prompt_tokens"] += tokens + message_tokens
+    totals["max_completion_tokens"] = totals["requests"] * MAX_TOKENS
+    return totals
+
+
+def batch_mode(client: ChatClient, source: TextIO, personas: List[Persona],
+               output: Optional[str] = None, concurrency: int = DEFAULT_CONCURRENCY,
+               cache: Optional[ResponseCache] = None) -> int:
+    """Rewrite every message of a batch input for every persona, writing JSONL.
+
+    Each output line holds the message id and text, the persona label and
+    description, and either the "rewrite" or an "error". Results are written
+    as they complete, with up to `concurrency` requests in flight. Writing to
+    an existing output file resumes: pairs already rewritten there are
+    skipped, and failed pairs are tried again. Returns the number that failed.
+    """
+    done = completed_pairs(output) if output else set()
+    out = open_batch_output(output) if output else sys.stdout
+    counts = {"rewritten": 0, "failed": 0, "skipped": 0}
+    
+    def tasks() -> Iterator[Tuple[Dict[str, str], Persona]]:
+        for item in read_batch(source):
+            for persona in personas:
+                if (item["id"], persona.description) in done:
+                    counts["skipped"] += 1
+                else:
+                    yield item, persona
+    
+    def run(item: Dict[str, str], persona: Persona) -> Dict[str, str]:
+        record = {
+            "id": item["id"],
+            "message": item["message"],
+            "persona": persona.label,
+            "description": persona.description,
+        }
+        try:
+            record["rewrite"] = rewrite_message(client, item["message"], persona, cache)
+        except RewriteError as e:
+            record["error"] = str(e)
+        return record
+    
+    def write(record: Dict[str, str]):
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        counts["failed" if "error" in record else "rewritten"] += 1
+        finished = counts["rewritten"] + counts["failed"]
+        if finished % 100 == 0:
+            print(f"{finished} pairs processed...", file=sys.stderr)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Keep a bounded window of requests queued, so a large input is
+            # read as it is processed rather than all up front.
+            pending = set()
+            for item, persona in tasks():
+                if len(pending) >= concurrency * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write(future.result())
+                pending.add(pool.submit(run, item, persona))
+            for future in wait(pending).done:
+                write(future.result())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    
+    print(f"Batch complete: {counts['rewritten']} rewritten, {counts['failed']} failed, "
+          f"{counts['skipped']} already done.", file=sys.stderr)
+    return counts["failed"]
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Rewrite messages for different personas using OpenAI",
@@ -350,6 +927,71 @@ to select personas before processing messages.
         help="Custom persona description (can be specified multiple times)"
     )
     
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum persona rewrites to request at once (default: {DEFAULT_CONCURRENCY})"
+    )
+    
+    parser.add_argument(
+        "-s", "--stream",
+        action="store_true",
+        help="Print each rewrite as it is generated instead of when all are complete"
+    )
+    
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help=f"Times to retry a rate-limited or failed API call (default: {DEFAULT_RETRIES})"
+    )
+    
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Report API call latency, retries and token usage on exit"
+    )
+    
+    parser.add_argument(
+        "-b", "--batch",
+        metavar="FILE",
+        help="Rewrite every message in FILE ('-' for stdin), one per line as plain text "
+             "or JSON with \"message\" and optional \"id\", then exit"
+    )
+    
+    parser.add_argument(
+        "-o", "--output",
+        metavar="FILE",
+        help="Append --batch results to FILE as JSONL, skipping pairs it already has "
+             "(default: stdout)"
+    )
+    
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Estimate the requests and tokens --batch would use, then exit without calling the API"
+    )
+    
+    parser.add_argument(
+        "--cache",
+        default=default_cache_path(),
+        help="Response cache file (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help=f"Most rewrites to keep in the cache (default: {DEFAULT_CACHE_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the API, neither reading nor writing the response cache"
+    )
+    
     parser.add_argument(
         "message",
         nargs="?",
@@ -358,8 +1000,41 @@ to select personas before processing messages.
     
     args = parser.parse_args()
     
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries cannot be negative")
+    if args.batch and not (args.mb_types or args.custom_personas):
+        parser.error("--batch needs personas given with -m or -p")
+    if args.batch and args.message:
+        parser.error("--batch cannot be combined with a message argument")
+    if args.output and not args.batch:
+        parser.error("--output is only used with --batch")
+    if args.batch and args.batch != "-" and not os.path.isfile(args.batch):
+        parser.error(f"Batch file not found: {args.batch}")
+    if args.estimate and not args.batch:
+        parser.error("--estimate is only used with --batch")
+    
+    if args.estimate:
+        personas = build_persona_description(args.mb_types, args.custom_personas)
+        if args.batch == "-":
+            totals = estimate_batch(sys.stdin, personas, args.output)
+        else:
+            with open(args.batch, encoding="utf-8") as source:
+                totals = estimate_batch(source, personas, args.output)
+        method = "tiktoken" if token_encoding() is not None else "about four characters a token"
+        print(f"{totals['requests']} requests ({totals['skipped']} already done): "
+              f"about {totals['prompt_tokens']:,} prompt tokens ({method}) and at most "
+              f"{totals['max_completion_tokens']:,} completion tokens ({MAX_TOKENS} per request).")
+        sys.exit(0)
+    
     # Initialize OpenAI client
-    client = get_client()
+    client = ChatClient(get_client(), args.retries)
+    if args.metrics:
+        atexit.register(lambda: print(client.metrics.summary(), file=sys.stderr))
+    cache = None if args.no_cache else ResponseCache(args.cache, args.cache_size)
     
     # If personas are specified via command line, use them
     # Otherwise, show interactive menu
@@ -370,6 +1045,14 @@ to select personas before processing messages.
         if not personas:
             print("Error: No valid personas specified.", file=sys.stderr)
             sys.exit(1)
+        
+        if args.batch:
+            if args.batch == "-":
+                failed = batch_mode(client, sys.stdin, personas, args.output, args.concurrency, cache)
+            else:
+                with open(args.batch, encoding="utf-8") as source:
+                    failed = batch_mode(client, source, personas, args.output, args.concurrency, cache)
+            sys.exit(1 if failed else 0)
     else:
         # Show interactive persona selection menu
         print("="*70)
@@ -383,10 +1066,10 @@ to select personas before processing messages.
     
     # Process initial message if provided
     if args.message:
-        process_message(client, args.message, personas)
+        process_message(client, args.message, personas, args.concurrency, args.stream, cache)
     
     # Enter interactive mode
-    interactive_mode(client, personas)
+    interactive_mode(client, personas, args.concurrency, args.stream, cache)
 
 
 if __name__ == "__main__":
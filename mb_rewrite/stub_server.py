@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+stub_server.py - Stand-in OpenAI chat-completions server for benchmarking
+
+Answers POST /v1/chat/completions with a canned rewrite, after a fixed delay
+and then one word per --token-delay (streamed as server-sent events when the
+request asks for it), so mb_rewrite.py can be timed end to end without an
+API key or network.
+Point the script at it with:
+
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8099/v1 ./mb_rewrite.py ...
+
+or run with --benchmark to time sequential against concurrent fan-out, with
+and without streaming.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+DEFAULT_PORT = 8099
+DEFAULT_LATENCY = 1.0
+DEFAULT_TOKEN_DELAY = 0.02
+DEFAULT_RETRY_AFTER = 0.5
+REPLY_WORDS = 40
+
+
+def usage(prompt: str, content: str) -> dict:
+    """Rough token counts for a reply, at four characters a token."""
+    return {
+        "prompt_tokens": len(prompt) // 4,
+        "completion_tokens": len(content) // 4,
+        "total_tokens": (len(prompt) + len(content)) // 4,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers chat completions with a canned reply, `server.latency` seconds to
+    the first word and `server.token_delay` seconds for each one after. A
+    `server.error_rate` fraction of requests are refused with a 429."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        if random.random() < self.server.error_rate:
+            self.send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                           {"Retry-After": str(self.server.retry_after)})
+            return
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        words = [f"(stub rewrite of a {len(prompt)} character prompt)"]
+        words += [f"word{i}" for i in range(1, REPLY_WORDS)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "stub")
+        time.sleep(self.server.latency)
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.server.token_delay)
+                text = word if i + 1 == len(words) else word + " "
+                self.send_event(completion_id, model, {"content": text}, None)
+            self.send_event(completion_id, model, {}, "stop")
+            if request.get("stream_options", {}).get("include_usage"):
+                self.send_event(completion_id, model, None, None, usage(prompt, " ".join(words)))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        time.sleep(self.server.token_delay * (len(words) - 1))
+        content = " ".join(words)
+        self.send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(prompt, content),
+        })
+
+    def send_event(self, completion_id: str, model: str, delta: Optional[dict], finish_reason,
+                   usage: Optional[dict] = None):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            "usage": usage,
+        }
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def start_server(port: int, latency: float, token_delay: float = DEFAULT_TOKEN_DELAY,
+                 error_rate: float = 0.0, retry_after: float = DEFAULT_RETRY_AFTER,
+                 quiet: bool = False) -> ThreadingHTTPServer:
+    """Start the stub server on a daemon thread and return it."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_delay = token_delay
+    server.error_rate = error_rate
+    server.retry_after = retry_after
+    server.quiet = quiet
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FirstWrite:
+    """Discards output, remembering when the first rewrite text was written."""
+
+    def __init__(self):
+        self.first = None
+
+    def write(self, text: str):
+        # Skip the "[label]" and dashes that head each SectionPrinter section.
+        is_header = text.startswith("[") or text.startswith("-" * 70)
+        if self.first is None and text.strip() and not is_header:
+            self.first = time.perf_counter()
+
+    def flush(self):
+        pass
+
+
+def benchmark(port: int, latency: float, token_delay: float, error_rate: float, retry_after: float,
+              mb_types: List[str], concurrency: List[int], repeat: int):
+    """Time rewrite_all and stream_all for the given personas at each concurrency level."""
+    from openai import OpenAI
+    import mb_rewrite
+
+    server = start_server(port, latency, token_delay, error_rate, retry_after, quiet=True)
+    client = mb_rewrite.ChatClient(
+        OpenAI(api_key="stub", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1"))
+    personas = mb_rewrite.build_persona_description(mb_types, [])
+    message = "Can we move tomorrow's meeting to Thursday afternoon?"
+
+    print(f"{len(personas)} personas, {latency:.2f}s to first token and "
+          f"{token_delay * 1000:.0f}ms per word after, per request")
+    print(f"  {'':22} {'total':>8} {'first output':>13}")
+    for level in concurrency:
+        for stream in (False, True):
+            best = None
+            for i in range(repeat):
+                out = FirstWrite()
+                start = time.perf_counter()
+                if stream:
+                    mb_rewrite.stream_all(client, message, personas, level, out)
+                else:
+                    mb_rewrite.rewrite_all(client, message, personas, level)
+                    out.write("done")
+                elapsed = time.perf_counter() - start
+                first = out.first - start
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, first)
+            label = f"concurrency {level}" + (" stream" if stream else "")
+            print(f"  {label:22} {best[0]:7.2f}s {best[1]:12.2f}s")
+    server.shutdown()
+    print(client.metrics.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in OpenAI chat-completions server for benchmarking mb_rewrite.py"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on (default: {DEFAULT_PORT})"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=DEFAULT_LATENCY,
+        help=f"Seconds to wait before answering each request (default: {DEFAULT_LATENCY})"
+    )
+    parser.add_argument(
+        "--token-delay",
+        type=float,
+        default=DEFAULT_TOKEN_DELAY,
+        help=f"Seconds between words of each reply (default: {DEFAULT_TOKEN_DELAY})"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests to refuse with 429 Too Many Requests (default: 0)"
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=DEFAULT_RETRY_AFTER,
+        help=f"Retry-After seconds sent with each 429 (default: {DEFAULT_RETRY_AFTER})"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time mb_rewrite's fan-out against the stub instead of serving"
+    )
+    parser.add_argument(
+        "-m", "--meyers-briggs",
+        action="append",
+        dest="mb_types",
+        help="Persona for --benchmark (repeatable; default: all 16 types)"
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        action="append",
+        help="Concurrency level for --benchmark (repeatable; default: 1 and 8)"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Runs per concurrency level for --benchmark; the best is reported"
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        from mb_rewrite import MB_DESCRIPTIONS
+        benchmark(args.port, args.latency, args.token_delay, args.error_rate, args.retry_after,
+                  args.mb_types or list(MB_DESCRIPTIONS), args.concurrency or [1, 8], args.repeat)
+        return
+
+    server = start_server(args.port, args.latency, args.token_delay, args.error_rate, args.retry_after)
+    print(f"Serving stub chat completions on http://127.0.0.1:{args.port}/v1", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -29,65 +29,445 @@
 """A script to list all the (unique) urls posted by a given reddit user"""
 
 import argparse
+import json
+import os
+import Queue
+import random
 import requests
+import sqlite3
 import sys
+import threading
+import time
 import webbrowser
 
 _headers = {
 	"User-Agent" : "submitted.py/0.1 by iwinulose"
 }
 
-#TODO:
-# - option for more than just submission (comment, all)
+# One keep-alive session for every request, so paging through a long
+# history doesn't pay for a new connection per page.
+_session = requests.Session()
+_session.headers.update(_headers)
+
+# reddit sends 429 when a client pages faster than it allows, and 5xx while
+# it's overloaded; get_listing backs off and asks again up to MAX_RETRIES times.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+
+class BadResponse(requests.RequestException):
+	"""reddit kept refusing a request after every retry."""
+
+class Scheduler(object):
+	"""Token bucket shared by every pager in the process.
+
+	Allows `rate` requests per second in bursts of up to `burst` to begin
+	with; after each response, update() spreads the requests reddit says
+	remain (X-Ratelimit-Remaining) over the seconds until the window resets
+	(X-Ratelimit-Reset), and pause() holds everyone back after a 429."""
+
+	def __init__(self, rate=1.0, burst=5):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = float(burst)
+		self.updated = time.time()
+		self.paused_until = 0.0
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""Blocks until a request may be sent."""
+		while True:
+			with self.lock:
+				now = time.time()
+				self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if now >= self.paused_until and self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+			time.sleep(wait)
+
+	def update(self, headers):
+		remaining = headers.get("X-Ratelimit-Remaining")
+		reset = headers.get("X-Ratelimit-Reset")
+		if remaining is None or reset is None:
+			return
+		remaining = float(remaining)
+		reset = max(float(reset), 1.0)
+		if remaining < 1:
+			self.pause(reset)
+			return
+		with self.lock:
+			self.rate = remaining / reset
+
+	def pause(self, seconds):
+		with self.lock:
+			self.paused_until = max(self.paused_until, time.time() + seconds)
+
+_scheduler = Scheduler()
+
+def retry_delay(resp, attempt):
+	"""Seconds to wait before retrying: Retry-After if reddit sent one,
+	otherwise exponential backoff with jitter."""
+	retry_after = resp.headers.get("Retry-After") if resp is not None else None
+	if retry_after:
+		try:
+			return float(retry_after)
+		except ValueError:
+			pass
+	return (2 ** attempt) + random.random()
+
+def get_listing(url, params, session=_session, scheduler=_scheduler):
+	"""GETs a listing through the scheduler, retrying on RETRY_STATUSES and
+	connection errors. Returns the listing's "data" dict or raises
+	BadResponse, rather than letting a refusal look like an empty history."""
+	resp = None
+	for attempt in range(MAX_RETRIES + 1):
+		scheduler.acquire()
+		try:
+			resp = session.get(url, params=params, timeout=30)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			if attempt == MAX_RETRIES:
+				raise
+			time.sleep(retry_delay(None, attempt))
+			continue
+		scheduler.update(resp.headers)
+		if resp.status_code == 200:
+			return resp.json()["data"]
+		if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+			break
+		delay = retry_delay(resp, attempt)
+		if resp.status_code == 429:
+			scheduler.pause(delay)
+		time.sleep(delay)
+	raise BadResponse("Got a bad response ({}) from {}".format(resp, url), response=resp)
 
 POST_TYPES = ("submitted", "comments", "all")
 
+# Most posts reddit will return in one page.
+PAGE_SIZE = 100
+
 def make_url(username, post_type=POST_TYPES[0]):
 	"""Create the API url for submissions"""
 	return "http://api.reddit.com/user/{user}/{type}".format(user=username, type=post_type)
 
-def submitted_urls(username, after=None, post_type=POST_TYPES[0], num_left=None):
-	"""Returns a set of all URLs submitted by the given user."""
-	num_to_fetch = 100
-	if num_left is not None:
-		if num_left > 100:
-			num_to_fetch = 100
-		else:
-			num_to_fetch = num_left
-	params = dict()
-	params["limit"] = num_to_fetch 
-	if after:
-		params["after"] = after
+# Kinds of "thing" (see reddit's API docs) that make up each listing.
+KINDS = {
+	"submitted": ("t3",),
+	"comments": ("t1",),
+	"all": ("t1", "t3"),
+}
+
+def default_store_path():
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "submitted", "posts.sqlite")
+
+class Store(object):
+	"""Local copy of users' posts, with a high-water mark per user and feed.
+
+	The mark is the newest post seen by the last sync that went all the way
+	back to the previous mark (or to the start of the history), so everything
+	older than it is known to be stored. Backed by SQLite, with a connection
+	per thread, so crawl_users' workers and the two feeds behind -t all can
+	all read and write the one Store."""
+
+	def __init__(self, path):
+		self.path = path
+		self.local = threading.local()
+		directory = os.path.dirname(path)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		with self.connection() as conn:
+			conn.execute("""CREATE TABLE IF NOT EXISTS posts
+				(user TEXT, name TEXT, kind TEXT, created REAL, data TEXT,
+				PRIMARY KEY (user, name))""")
+			conn.execute("CREATE INDEX IF NOT EXISTS posts_by_date ON posts (user, created)")
+			conn.execute("""CREATE TABLE IF NOT EXISTS marks
+				(user TEXT, post_type TEXT, name TEXT, created REAL,
+				PRIMARY KEY (user, post_type))""")
+
+	def connection(self):
+		conn = getattr(self.local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=30)
+			# Readers don't block writers, so one feed's sync can commit while
+			# the other is still reading its stored posts.
+			conn.execute("PRAGMA journal_mode=WAL")
+			self.local.conn = conn
+		return conn
+
+	def high_water(self, username, post_type):
+		"""Returns (name, created) of the newest fully-synced post, or None."""
+		return self.connection().execute(
+			"SELECT name, created FROM marks WHERE user = ? AND post_type = ?",
+			(username.lower(), post_type)).fetchone()
+
+	def set_high_water(self, username, post_type, post):
+		with self.connection() as conn:
+			conn.execute("INSERT OR REPLACE INTO marks VALUES (?, ?, ?, ?)",
+				(username.lower(), post_type, post["data"]["name"], post["data"]["created_utc"]))
+
+	def add(self, username, posts):
+		rows = [(username.lower(), post["data"]["name"], post["kind"],
+			post["data"]["created_utc"], json.dumps(post["data"])) for post in posts]
+		with self.connection() as conn:
+			conn.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?)", rows)
+
+	def posts(self, username, post_type=POST_TYPES[0]):
+		"""Yields the stored posts in the feed, newest first, in the same
+		shape as the API's listing children. Needs no network access."""
+		kinds = KINDS[post_type]
+		query = "SELECT kind, data FROM posts WHERE user = ? AND kind IN ({}) ORDER BY created DESC".format(
+			", ".join("?" * len(kinds)))
+		# Read everything up front rather than holding a cursor (and its read
+		# lock) open while the caller is suspended between posts.
+		rows = self.connection().execute(query, (username.lower(),) + kinds).fetchall()
+		for kind, data in rows:
+			yield {"kind": kind, "data": json.loads(data)}
+
+def pages(username, after=None, post_type=POST_TYPES[0], num_left=None, session=_session):
+	"""Yields each page of the user's posts (the listing's "data" dict, with
+	"children" newest first and the "after" cursor), following the cursor
+	until the history or num_left runs out. Raises BadResponse if reddit
+	keeps refusing a page."""
 	base_url = make_url(username, post_type=post_type)
-	resp = requests.get(base_url, params=params, headers=_headers)
-	if resp.status_code != 200:
-		sys.stderr.write("Got a bad response ({})\n".format(resp))
-		return set()
-	json = resp.json()["data"]
-	after = json["after"]
-	children = json["children"]
-	urls = set([post["data"]["url"] for post in children])
-	if num_left is not None:
-		num_left -= len(children)
-		if num_left <= 0:
-			return urls
-	if after:
-		next = submitted_urls(username, after=after, post_type=post_type, num_left=num_left)
-		urls = urls.union(next)
-	return urls
-	
+	while num_left is None or num_left > 0:
+		params = dict()
+		params["limit"] = PAGE_SIZE if num_left is None else min(num_left, PAGE_SIZE)
+		if after:
+			params["after"] = after
+		listing = get_listing(base_url, params, session)
+		children = listing["children"]
+		yield listing
+		after = listing["after"]
+		if num_left is not None:
+			num_left -= len(children)
+		if not after or not children:
+			return
+
+def sync(username, store, post_type=POST_TYPES[0]):
+	"""Yields the user's posts that are newer than the store's high-water
+	mark, newest first, saving each page as it arrives. Paging stops at the
+	first already-known post, and the mark only moves once the gap back to
+	it has been closed, so an interrupted sync is simply redone next time."""
+	mark = store.high_water(username, post_type)
+	newest = None
+	for listing in pages(username, post_type=post_type):
+		fresh = []
+		reached_mark = False
+		for post in listing["children"]:
+			data = post["data"]
+			if mark and (data["name"] == mark[0] or data["created_utc"] < mark[1]):
+				reached_mark = True
+				break
+			fresh.append(post)
+		store.add(username, fresh)
+		if newest is None and fresh:
+			newest = fresh[0]
+		for post in fresh:
+			yield post
+		if reached_mark or not listing["after"]:
+			if newest is not None:
+				store.set_high_water(username, post_type, newest)
+			return
+
+def posts(username, after=None, post_type=POST_TYPES[0], num_left=None, store=None, offline=False):
+	"""Yields the user's posts, newest first. Without a store, straight from
+	the API (starting past `after`, if given). With one, new posts are synced
+	(unless offline) and yielded as they arrive, followed by the older posts
+	already in the store.
+
+	"all" has no feed of its own: submissions and comments are fetched
+	concurrently and merged by date."""
+	if post_type == "all":
+		feeds = [posts(username, post_type=feed, num_left=num_left, store=store, offline=offline)
+			for feed in ("submitted", "comments")]
+		for count, post in enumerate(merge_feeds(feeds)):
+			if num_left is not None and count >= num_left:
+				return
+			yield post
+		return
+	if store is None:
+		for listing in pages(username, after=after, post_type=post_type, num_left=num_left):
+			for post in listing["children"]:
+				yield post
+		return
+	seen = set()
+	count = 0
+	if not offline:
+		for post in sync(username, store, post_type):
+			if num_left is not None and count >= num_left:
+				return
+			seen.add(post["data"]["name"])
+			count += 1
+			yield post
+	for post in store.posts(username, post_type):
+		if num_left is not None and count >= num_left:
+			return
+		if post["data"]["name"] not in seen:
+			count += 1
+			yield post
+
+# Marks the end of a feed in merge_feeds' queues.
+_DONE = object()
+
+def _put(queue, item, stop=None):
+	"""Puts item on queue unless stop gets set first. Returns success. Like
+	_get, it waits with a timeout so ^C still gets through under Python 2."""
+	while stop is None or not stop.is_set():
+		try:
+			queue.put(item, timeout=0.5)
+			return True
+		except Queue.Full:
+			pass
+	return False
+
+def _get(queue):
+	# A timeout keeps the wait interruptible by ^C under Python 2.
+	while True:
+		try:
+			return queue.get(timeout=0.5)
+		except Queue.Empty:
+			pass
+
+def _join(thread):
+	# Thread.join() without a timeout can't be interrupted under Python 2 either.
+	while thread.is_alive():
+		thread.join(0.5)
+
+def _drain(feed, queue, stop):
+	try:
+		for post in feed:
+			if not _put(queue, post, stop):
+				return
+	except Exception as e:
+		_put(queue, e, stop)
+		return
+	_put(queue, _DONE, stop)
+
+def merge_feeds(feeds):
+	"""Runs each feed (an iterator of posts, newest first) on its own thread
+	and yields all their posts merged newest first, as they arrive. Only a
+	page's worth of each feed is buffered ahead of the consumer."""
+	stop = threading.Event()
+	queues = []
+	for feed in feeds:
+		queue = Queue.Queue(maxsize=PAGE_SIZE)
+		thread = threading.Thread(target=_drain, args=(feed, queue, stop))
+		thread.daemon = True
+		thread.start()
+		queues.append(queue)
+	try:
+		heads = [_get(queue) for queue in queues]
+		while True:
+			for head in heads:
+				if isinstance(head, Exception):
+					raise head
+			live = [i for i, head in enumerate(heads) if head is not _DONE]
+			if not live:
+				return
+			newest = max(live, key=lambda i: heads[i]["data"]["created_utc"])
+			yield heads[newest]
+			heads[newest] = _get(queues[newest])
+	finally:
+		stop.set()
+
+def post_url(post):
+	"""The URL a post points at. Comments carry their submission's link_url."""
+	data = post["data"]
+	return data.get("url") or data.get("link_url")
+
+def submitted_urls(username, after=None, post_type=POST_TYPES[0], num_left=None, store=None, offline=False):
+	"""Yields each unique URL submitted by the given user, as the pages
+	containing them arrive."""
+	seen = set()
+	stream = posts(username, after=after, post_type=post_type, num_left=num_left, store=store, offline=offline)
+	for post in stream:
+		url = post_url(post)
+		if url and url not in seen:
+			seen.add(url)
+			yield url
+
+def read_usernames(file):
+	"""Lazily yields the usernames in file, one per line."""
+	for line in file:
+		line = line.strip()
+		if line:
+			yield line
+
+def crawl_users(usernames, out, jobs=8, post_type=POST_TYPES[0], num_left=None, store=None, offline=False):
+	"""Runs a pager for each of usernames on `jobs` threads, writing every URL
+	to out as a JSON line ({"user": ..., "url": ...}) as soon as it arrives.
+
+	usernames is consumed lazily and only a few are queued ahead of the
+	workers, so memory stays flat however long the list is."""
+	_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=jobs))
+	_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=jobs))
+	users = Queue.Queue(maxsize=jobs * 2)
+	out_lock = threading.Lock()
+
+	def worker():
+		while True:
+			username = users.get()
+			if username is None:
+				return
+			try:
+				urls = submitted_urls(username, post_type=post_type, num_left=num_left,
+					store=store, offline=offline)
+				for url in urls:
+					line = json.dumps({"user": username, "url": url})
+					with out_lock:
+						out.write(line + "\n")
+			except requests.RequestException as e:
+				sys.stderr.write("Error fetching posts for {}: {}\n".format(username, e))
+			except Exception as e:
+				# Anything else (a malformed listing, a store error) only loses
+				# this user; a dead worker would leave users.put() blocked.
+				sys.stderr.write("Error processing posts for {}: {!r}\n".format(username, e))
+			with out_lock:
+				out.flush()
+
+	threads = [threading.Thread(target=worker) for i in range(jobs)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for username in usernames:
+		_put(users, username)
+	for thread in threads:
+		_put(users, None)
+	for thread in threads:
+		_join(thread)
+
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Lists all the (unique) urls of posts by a given reddit user")
-	parser.add_argument("username", help="The username")
+	parser.add_argument("username", nargs="?", help="The username")
 	parser.add_argument("--open", action="store_true", help="Open the links in a browser")
-#	parser.add_argument("-t", "--post-type", help="User submissions, comments, or all posts", choices=POST_TYPES, default=POST_TYPES[0])
+	parser.add_argument("-t", "--post-type", help="User submissions, comments, or all posts", choices=POST_TYPES, default=POST_TYPES[0])
 	parser.add_argument("-n", "--number", type=int, default=None, help="Number of results to return (most recent.)")
+	parser.add_argument("-b", "--batch", type=argparse.FileType('r'), help="Read usernames from this file ('-' for stdin), one per line, and write JSON lines of {user, url} to stdout")
+	parser.add_argument("-j", "--jobs", type=int, default=8, help="Number of users to fetch at once in batch mode (default: 8)")
+	parser.add_argument("--store", default=default_store_path(), help="Local store of fetched posts. Each run only fetches posts newer than the last sync. (default: %(default)s)")
+	parser.add_argument("--no-store", action="store_true", help="Fetch the whole history from the API without reading or writing the store")
+	parser.add_argument("--offline", action="store_true", help="Answer from the store only, without touching the network")
 	args = parser.parse_args()
-	urls = submitted_urls(args.username, post_type=args.post_type, num_left=args.number)
-	if urls:
-		urls = map(lambda url: url.encode('utf-8'), urls)
-		print "\n".join(urls)
-		if args.open:
-			for url in urls:
+	if args.offline and args.no_store:
+		parser.error("--offline needs the store")
+	store = None if args.no_store else Store(args.store)
+	if args.batch:
+		if args.jobs < 1:
+			parser.error("--jobs must be at least 1")
+		crawl_users(read_usernames(args.batch), sys.stdout, jobs=args.jobs, post_type=args.post_type,
+			num_left=args.number, store=store, offline=args.offline)
+		sys.exit(0)
+	if not args.username:
+		parser.error("A username or --batch is required")
+	urls = submitted_urls(args.username, post_type=args.post_type, num_left=args.number,
+		store=store, offline=args.offline)
+	try:
+		for url in urls:
+			print url.encode('utf-8')
+			sys.stdout.flush()
+			if args.open:
 				webbrowser.open(url)
-
+	except requests.RequestException as e:
+		sys.stderr.write("{}\n".format(e))
+		sys.exit(1)